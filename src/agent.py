@@ -1,30 +1,80 @@
+import asyncio
+import functools
 import os
 import json
-from typing import Dict, Any, Optional, Union
-from pydantic import BaseModel, Field
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from typing import Deque, Dict, Any, List, Optional, Set, Tuple, Union
+from pydantic import BaseModel, Field, PrivateAttr
 from memory.procedual_memory import ProcedualMemory
 from memory.episodic_memory import EpisodicMemory, Episode
 from memory.semantic_memory import SemanticMemory
+from memory.related_memory import remember_related_memories
+from memory.vector_index import (
+    DEFAULT_ANN_NPROBE,
+    DEFAULT_ANN_THRESHOLD,
+    DEFAULT_COMPACT_AFTER,
+)
+from tools.base import AgentTool, AgentToolTimeoutError
+from tools.cache import ToolResultCache, TOOL_CACHE_FILENAME
 from ui.base import BaseHumanUserInterface
 from ui.cui import CommandlineUserInterface
 import llm.reason.prompt as ReasonPrompt
 from task_manager import Task
 from task_manager import TaskManeger
 from llm.json_output_parser import LLMJsonOutputParser
+from llm.chunker import (
+    DEFAULT_CHUNK_TOKENS,
+    DEFAULT_EXCERPT_TOKENS,
+    iter_chunks,
+    make_excerpt,
+)
+from llm.prompt_budget import PromptBudget, PromptBudgeter, TokenCounter
+from llm.streaming_json_parser import (
+    IncrementalJsonParser,
+    JsonPath,
+    StreamingJsonCallbackHandler,
+)
 from llm.reason.schema import JsonSchema as ReasonSchema
+from llm.reason.schema import ParallelJsonSchema as ParallelReasonSchema
 from langchain.llms.base import BaseLLM
-from langchain import LLMChain
-from langchain.chat_models import ChatOpenAI
+from langchain import LLMChain, PromptTemplate
+from langchain.chat_models.base import BaseChatModel
+from langchain.embeddings.base import Embeddings
+from memory.embeddings import CachedEmbeddings, get_shared_embeddings
+from llm.cache import CachedChatModel, CachedLLM, LLMResponseCache, LLM_CACHE_FILENAME
 
 # Define the default values
 DEFAULT_AGENT_NAME = "AI"
 DEFAULT_AGENT_ROLE = "Autonomous AI agent that uses both inference and tools to answer many things"
 DEFAULT_AGENT_GOAL = "Ending world hunger"
 DEFAULT_AGENT_DIR = "./agent_data"
+EMBEDDING_CACHE_FILENAME = "embedding_cache.sqlite3"
 
 
 # Define the schema for the llm output
 REASON_JSON_SCHEMA_STR = json.dumps(ReasonSchema.schema)
+PARALLEL_REASON_JSON_SCHEMA_STR = json.dumps(ParallelReasonSchema.schema)
+DEFAULT_MAX_ACTION_WORKERS = 4
+DEFAULT_LARGE_RESULT_TOKENS = 2000
+DEFAULT_MAX_CHUNK_WORKERS = 4
+
+# The titles the thoughts are shown with
+THOUGHT_TITLES = {
+    "task": "TASK",
+    "idea": "IDEA",
+    "reasoning": "REASONING",
+    "criticism": "CRITICISM",
+    "summary": "THOUGHT",
+}
+
+
+class ReasoningActionReady(Exception):
+    """Exception stopping a streamed reasoning once its action is complete"""
+
+    def __init__(self, result: Dict[str, Any]) -> None:
+        super().__init__("The action of the reasoning is complete")
+        self.result = result
 
 
 class Agent(BaseModel):
@@ -40,26 +90,153 @@ class Agent(BaseModel):
     ui: BaseHumanUserInterface = Field(
         CommandlineUserInterface(), description="The user interface for the agent")
     llm: BaseLLM = Field(..., description="llm class for the agent")
-    openaichat: Optional[ChatOpenAI] = Field(
+    openaichat: Optional[BaseChatModel] = Field(
         None, description="ChatOpenAI class for the agent")
+    embeddings: Embeddings = Field(
+        default_factory=get_shared_embeddings,
+        description="The embeddings shared by all memories of the agent")
     prodedural_memory: ProcedualMemory = Field(
-        ProcedualMemory(), description="The procedural memory about tools agent uses")
+        None, description="The procedural memory about tools agent uses")
     episodic_memory: EpisodicMemory = Field(
         None, description="The short term memory of the agent")
     semantic_memory: SemanticMemory = Field(
         None, description="The long term memory of the agent")
     task_manager: TaskManeger = Field(
         None, description="The task manager for the agent")
+    llm_cache_mode: Optional[str] = Field(
+        None,
+        description="'record' to cache the LLM responses in the agent dir, "
+                    "'replay' to only serve recorded responses, "
+                    "or None to disable the cache")
+    mmap_memory: bool = Field(
+        True,
+        description="Whether to memory-map the saved memory indexes instead of reading "
+                    "them")
+    _task_embedding: Tuple[Optional[str], List[float]] = PrivateAttr((None, []))
+    pipelined: bool = Field(
+        False,
+        description="Whether the next step reasons while the previous steps are still "
+                    "being memorized")
+    pipeline_max_lag: Optional[int] = Field(
+        1,
+        description="The number of steps that may still be memorized when a step "
+                    "reasons, or None to never wait")
+    # One worker per memory, so each memory is written in step order.
+    _episodic_executor: ThreadPoolExecutor = PrivateAttr(
+        default_factory=lambda: ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="memorize-episode"))
+    _semantic_executor: ThreadPoolExecutor = PrivateAttr(
+        default_factory=lambda: ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="memorize-knowledge"))
+    _pending_memories: Deque[Tuple[Future, Future]] = PrivateAttr(default_factory=deque)
+    stream_reasoning: bool = Field(
+        False,
+        description="Whether to parse the reasoning while it streams, showing thoughts "
+                    "and acting once the action is complete. The model must be created "
+                    "with streaming=True")
+    _streamed_thoughts: Set[str] = PrivateAttr(default_factory=set)
+    _reason_chains: Dict[int, LLMChain] = PrivateAttr(default_factory=dict)
+    prompt_budget: PromptBudget = Field(
+        default_factory=PromptBudget,
+        description="The token budgets of the sections of the reasoning prompt")
+    prompt_tokens: Dict[str, int] = Field(
+        default_factory=dict,
+        description="The tokens of each section of the last reasoning prompt")
+    _token_counter: TokenCounter = PrivateAttr(default_factory=TokenCounter)
+    max_tools: Optional[int] = Field(
+        None,
+        description="The number of tools most relevant to the task put in the prompt, "
+                    "or None to put every tool")
+    _task_tools: Tuple[Optional[Tuple[str, int]], List[AgentTool]] = PrivateAttr(
+        (None, []))
+    knowledge_batch_steps: int = Field(
+        1,
+        description="The number of action results whose knowledge is extracted in one "
+                    "LLM call")
+    parallel_actions: bool = Field(
+        False,
+        description="Whether a step may call several independent tools, which run at "
+                    "the same time")
+    max_action_workers: int = Field(
+        DEFAULT_MAX_ACTION_WORKERS,
+        description="The number of tools run at the same time in one step")
+    _action_executor: ThreadPoolExecutor = PrivateAttr()
+    large_result_tokens: Optional[int] = Field(
+        DEFAULT_LARGE_RESULT_TOKENS,
+        description="The tokens of an action result above which it is chunked, or None "
+                    "to never chunk")
+    result_chunk_tokens: int = Field(
+        DEFAULT_CHUNK_TOKENS,
+        description="The tokens of each chunk of a large action result")
+    result_excerpt_tokens: int = Field(
+        DEFAULT_EXCERPT_TOKENS,
+        description="The tokens of the excerpt of a large action result kept in the "
+                    "prompts")
+    max_chunk_workers: int = Field(
+        DEFAULT_MAX_CHUNK_WORKERS,
+        description="The number of chunks of a large action result processed at the "
+                    "same time")
+    memory_compact_after: int = Field(
+        DEFAULT_COMPACT_AFTER,
+        description="The logged vectors after which a saved memory index is rewritten")
+    memory_ann_threshold: Optional[int] = Field(
+        DEFAULT_ANN_THRESHOLD,
+        description="The vectors from which a memory index turns IVF, "
+                    "or None to stay flat")
+    memory_ann_nprobe: int = Field(
+        DEFAULT_ANN_NPROBE, description="The IVF lists searched for each memory query")
+    knowledge_batch_chars: Optional[int] = Field(
+        None,
+        description="The number of characters of action results that triggers the "
+                    "knowledge extraction before the batch is full, or None")
+
+    class Config:
+        arbitrary_types_allowed = True
 
     def __init__(self, openai_api_key: str, dir: str,  **data: Any) -> None:
-        super().__init__(**data)
-        self.task_manager = TaskManeger(llm=self.llm)
-        self.episodic_memory = EpisodicMemory(llm=self.llm)
-        self.semantic_memory = SemanticMemory(llm=self.llm, openaichat=self.openaichat)
-
+        super().__init__(dir=dir, **data)
         self._get_absolute_path()
         self._create_dir_if_not_exists()
 
+        # Embeddings are cached under the agent directory across restarts.
+        if not isinstance(self.embeddings, CachedEmbeddings):
+            self.embeddings = CachedEmbeddings(
+                self.embeddings,
+                path=os.path.join(self._get_absolute_path(), EMBEDDING_CACHE_FILENAME))
+
+        # LLM responses are recorded under the agent directory to replay reruns.
+        if self.llm_cache_mode is not None:
+            response_cache = LLMResponseCache(
+                os.path.join(self._get_absolute_path(), LLM_CACHE_FILENAME),
+                mode=self.llm_cache_mode)
+            if not isinstance(self.llm, CachedLLM):
+                self.llm = CachedLLM(llm=self.llm, response_cache=response_cache)
+            if self.openaichat and not isinstance(self.openaichat, CachedChatModel):
+                self.openaichat = CachedChatModel(
+                    chat_model=self.openaichat, response_cache=response_cache)
+
+        self._action_executor = ThreadPoolExecutor(
+            max_workers=self.max_action_workers, thread_name_prefix="act")
+
+        self.task_manager = TaskManeger(llm=self.llm)
+        # Tool results are cached under the agent directory across restarts.
+        self.prodedural_memory = ProcedualMemory(
+            embeddings=self.embeddings,
+            result_cache=ToolResultCache(
+                os.path.join(self._get_absolute_path(), TOOL_CACHE_FILENAME)))
+        index_settings = {
+            "index_compact_after": self.memory_compact_after,
+            "ann_threshold": self.memory_ann_threshold,
+            "ann_nprobe": self.memory_ann_nprobe,
+        }
+        self.episodic_memory = EpisodicMemory(
+            llm=self.llm, embeddings=self.embeddings, **index_settings)
+        self.semantic_memory = SemanticMemory(
+            llm=self.llm, openaichat=self.openaichat, embeddings=self.embeddings,
+            **index_settings,
+            extraction_batch_steps=self.knowledge_batch_steps,
+            extraction_batch_chars=self.knowledge_batch_chars)
+
         if self._agent_data_exists():
             load_data = self.ui.get_binary_user_input(
                 "Agent data already exists. Do you want to load the data?\n"
@@ -103,31 +280,39 @@ class Agent(BaseModel):
                                message=current_task,
                                title_color="BLUE")
             else:
+                self._collect_memories(max_lag=0)
+                with self.ui.loading("Extract knowledge..."):
+                    extracted = self.semantic_memory.flush_extraction()
+                self._notify_extracted(extracted)
+                with self.ui.loading("Save agent data..."):
+                    self.save_agent()
                 self.ui.notify(title="FINISH",
                                message=f"All tasks are completed. {self.name} will end the operation.",
                                title_color="RED")
                 break
 
+            # A pipelined step reasons with the memories committed so far,
+            # waiting only for the steps beyond the allowed lag.
+            if self.pipelined:
+                self._collect_memories(max_lag=self.pipeline_max_lag)
+
             # ReAct: Reasoning
             with self.ui.loading("Thinking..."):
                 try:
                     reasoning_result = self._reason()
                     thoughts = reasoning_result["thoughts"]
-                    action = reasoning_result["action"]
-                    tool_name = action["tool_name"]
-                    args = action["args"]
+                    action = self._get_action(reasoning_result)
                 except Exception as e:
                     raise e
-            self.ui.notify(title="TASK", message=thoughts["task"])
-            self.ui.notify(title="IDEA", message=thoughts["idea"])
-            self.ui.notify(title="REASONING", message=thoughts["reasoning"])
-            self.ui.notify(title="CRITICISM", message=thoughts["criticism"])
-            self.ui.notify(title="THOUGHT", message=thoughts["summary"])
+            for field, title in THOUGHT_TITLES.items():
+                # Streamed thoughts were shown while reasoning.
+                if field not in self._streamed_thoughts:
+                    self.ui.notify(title=title, message=thoughts[field])
             self.ui.notify(title="NEXT ACTION", message=action)
 
             # Task Complete
-            if tool_name == "task_complete":
-                action_result = args["result"]
+            if action.get("tool_name") == "task_complete":
+                action_result = action["args"]["result"]
                 self._task_complete(action_result)
                 # save agent data
                 with self.ui.loading("Save agent data..."):
@@ -143,7 +328,7 @@ class Agent(BaseModel):
                     self.ui.notify(title="USER INPUT", message=action_result)
                 else:
                     try:
-                        action_result = self._act(tool_name, args)
+                        action_result = self._run_action(action)
                     except Exception as e:
                         raise e
                     self.ui.notify(title="ACTION RESULT", message=action_result)
@@ -154,90 +339,465 @@ class Agent(BaseModel):
                 result=action_result
             )
 
-            summary = self.episodic_memory.summarize_and_memorize_episode(episode)
+            self._pending_memories.append(self._memorize(episode))
+            if not self.pipelined:
+                self._collect_memories(max_lag=0)
+
+    async def arun(self) -> None:
+        """
+        Run the agent on an event loop, so many agents and tools can share one thread.
+        LLM calls and coroutine tools are awaited, and the blocking work, such as memory
+        retrieval, plain tools, user input and memorization, runs in worker threads.
+        """
+        loop = asyncio.get_running_loop()
+        with self.ui.loading("Generate Task Plan..."):
+            await loop.run_in_executor(None, functools.partial(
+                self.task_manager.generate_task_plan,
+                name=self.name,
+                role=self.role,
+                goal=self.goal
+            ))
+        self.ui.notify(title="ALL TASKS",
+                       message=self.task_manager.get_incomplete_tasks_string(),
+                       title_color="BLUE")
+
+        while True:
+            current_task = self.task_manager.get_current_task_string()
+            if current_task:
+                self.ui.notify(title="CURRENT TASK",
+                               message=current_task,
+                               title_color="BLUE")
+            else:
+                await self._acollect_memories(max_lag=0)
+                with self.ui.loading("Extract knowledge..."):
+                    extracted = await loop.run_in_executor(
+                        None, self.semantic_memory.flush_extraction)
+                self._notify_extracted(extracted)
+                with self.ui.loading("Save agent data..."):
+                    await loop.run_in_executor(None, self.save_agent)
+                self.ui.notify(
+                    title="FINISH",
+                    message=f"All tasks are completed. "
+                            f"{self.name} will end the operation.",
+                    title_color="RED")
+                break
+
+            if self.pipelined:
+                await self._acollect_memories(max_lag=self.pipeline_max_lag)
+
+            # ReAct: Reasoning
+            with self.ui.loading("Thinking..."):
+                reasoning_result = await self._areason()
+                thoughts = reasoning_result["thoughts"]
+                action = self._get_action(reasoning_result)
+            for field, title in THOUGHT_TITLES.items():
+                self.ui.notify(title=title, message=thoughts[field])
+            self.ui.notify(title="NEXT ACTION", message=action)
+
+            # Task Complete
+            if action.get("tool_name") == "task_complete":
+                action_result = action["args"]["result"]
+                self._task_complete(action_result)
+                with self.ui.loading("Save agent data..."):
+                    await loop.run_in_executor(None, self.save_agent)
+
+            # Action with tools
+            else:
+                user_permission = await loop.run_in_executor(
+                    None, self.ui.get_binary_user_input, "Do you want to continue?")
+                if not user_permission:
+                    action_result = "User Denied to run Action"
+                    self.ui.notify(title="USER INPUT", message=action_result)
+                else:
+                    action_result = await self._arun_action(action)
+                    self.ui.notify(title="ACTION RESULT", message=action_result)
+
+            episode = Episode(
+                thoughts=thoughts,
+                action=action,
+                result=action_result
+            )
+
+            self._pending_memories.append(self._memorize(episode))
+            if not self.pipelined:
+                await self._acollect_memories(max_lag=0)
+
+    def _memorize(self, episode: Episode) -> Tuple[Future, Future]:
+        """
+        Summarize the episode and extract the entities of its result at the same time.
+        Both are independent LLM calls, so they run on the memory executors.
+        A large result is processed chunk by chunk, and the episode keeps an excerpt.
+        """
+        chunks = self._chunk_result(episode)
+        if chunks is None:
+            return (
+                self._episodic_executor.submit(
+                    self.episodic_memory.summarize_and_memorize_episode, episode),
+                self._semantic_executor.submit(
+                    self.semantic_memory.extract_entity, episode.result)
+            )
+        return (
+            self._episodic_executor.submit(
+                self.episodic_memory.summarize_and_memorize_episode, episode,
+                chunks=chunks, max_workers=self.max_chunk_workers),
+            self._semantic_executor.submit(
+                self.semantic_memory.extract_entity_from_chunks, chunks,
+                max_workers=self.max_chunk_workers)
+        )
+
+    def _chunk_result(self, episode: Episode) -> Optional[List[str]]:
+        """
+        Split a large result of an episode into chunks, and replace it with an excerpt.
+        The whole result stays in the full_result of the episode, kept by the log.
+        """
+        counter = self._token_counter
+        if self.large_result_tokens is None \
+                or counter.count(episode.result) <= self.large_result_tokens:
+            return None
+        chunks = list(iter_chunks(episode.result, self.result_chunk_tokens, counter))
+        episode.full_result = episode.result
+        episode.result = make_excerpt(
+            episode.result, self.result_excerpt_tokens, counter)
+        return chunks
+
+    def _collect_memories(self, max_lag: Optional[int]) -> None:
+        """
+        Wait until at most max_lag steps are still being memorized,
+        and notify the memorized steps.
+        With max_lag None, only the steps already memorized are notified.
+        """
+        while self._pending_memories:
+            futures = self._pending_memories[0]
+            if (max_lag is None or len(self._pending_memories) <= max_lag) \
+                    and not all(future.done() for future in futures):
+                break
+            self._pending_memories.popleft()
+            # Wait for both calls even if one fails, so no write runs past the step.
+            wait(futures)
+            summary, entities = futures[0].result(), futures[1].result()
             self.ui.notify(title="MEMORIZE NEW EPISODE",
                            message=summary, title_color="blue")
+            self.ui.notify(title="MEMORIZE NEW KNOWLEDGE",
+                           message=entities, title_color="blue")
 
-            entities = self.semantic_memory.extract_entity(action_result)
+    def _notify_extracted(self, extracted: List[Tuple[str, dict]]) -> None:
+        """
+        Notify the knowledge extracted from the action results still queued for a batch.
+        They are extracted when the run ends,
+        so the last steps are not left out of the saved memory.
+        """
+        entities: Dict[str, Any] = {}
+        for _, text_entities in extracted:
+            entities.update(text_entities)
+        if entities:
             self.ui.notify(title="MEMORIZE NEW KNOWLEDGE",
                            message=entities, title_color="blue")
 
-    def _reason(self) -> Union[str, Dict[Any, Any]]:
+    async def _acollect_memories(self, max_lag: Optional[int]) -> None:
+        """
+        Await the steps beyond max_lag without blocking the event loop,
+        and notify the memorized steps.
+        """
+        if max_lag is not None:
+            num_beyond_lag = max(0, len(self._pending_memories) - max_lag)
+            beyond_lag = list(self._pending_memories)[:num_beyond_lag]
+            for futures in beyond_lag:
+                await asyncio.wait([asyncio.wrap_future(future) for future in futures])
+        self._collect_memories(max_lag)
+
+    def _prepare_reasoning(self) -> Tuple[Dict[str, Any], List[Episode]]:
+        """
+        Retrieve the memories of the current task,
+        and get the prompt inputs with the recent episodes.
+        """
         current_task_description = self.task_manager.get_current_task_string()
+        self._streamed_thoughts = set()
 
         # Retrie task related memories
         with self.ui.loading("Retrieve memory..."):
+            # Embed the task once and search every memory index with it.
+            task_embedding = self._embed_task(current_task_description)
+            related_memories = remember_related_memories(
+                task_embedding,
+                episodic_memory=self.episodic_memory,
+                semantic_memory=self.semantic_memory,
+                k_episodes=2,
+                k_knowledge=5
+            )
+
             # Retrieve memories related to the task.
-            related_past_episodes = self.episodic_memory.remember_related_episodes(
-                current_task_description,
-                k=2)
+            related_past_episodes = related_memories.episodes
             if len(related_past_episodes) > 0:
                 self.ui.notify(title="TASK RELATED EPISODE",
                                message=related_past_episodes)
 
             # Retrieve concepts related to the task.
-            related_knowledge = self.semantic_memory.remember_related_knowledge(
-                current_task_description,
-                k=5
-            )
+            related_knowledge = related_memories.knowledge
             if len(related_knowledge) > 0:
                 self.ui.notify(title="TASK RELATED KNOWLEDGE",
                                message=related_knowledge)
 
-        # Get the relevant tools
-        # If agent has to much tools, use "remember_relevant_tools"
-        # because too many tool information will cause context windows overflow.
-        tools = self.prodedural_memory.remember_all_tools()
+        # Fit each section of the prompt into its token budget,
+        # keeping the most relevant items and truncating long results.
+        budgeter = PromptBudgeter(self.prompt_budget, self._token_counter)
 
-        # Set up the prompt
-        tool_info = ""
-        for tool in tools:
-            tool_info += tool.get_tool_info() + "\n"
+        # Get the relevant tools
+        # Too many tool infos overflow the context window, so large catalogs
+        # only put the tools most relevant to the task in the prompt.
+        tools = self._remember_tools(current_task_description, task_embedding, budgeter)
 
         # Get the recent episodes
         memory = self.episodic_memory.remember_recent_episodes(2)
 
-        # If OpenAI Chat is available, it is used for higher accuracy results.
-        if self.openaichat:
-            propmt = ReasonPrompt.get_chat_template(memory=memory).format_prompt(
-                name=self.name,
-                role=self.role,
-                goal=self.goal,
-                related_past_episodes=related_past_episodes,
-                related_knowledge=related_knowledge,
-                task=current_task_description,
-                tool_info=tool_info
-            ).to_messages()
-            result = self.openaichat(propmt).content
+        related_knowledge = budgeter.fit_knowledge(related_knowledge)
+        related_past_episodes = budgeter.fit_past_episodes(related_past_episodes)
+        memory = budgeter.fit_recent_episodes(
+            memory, render=ReasonPrompt.get_recent_episodes)
+        tool_info = budgeter.fit_tool_info([tool.get_tool_info() for tool in tools])
+        dropped_tools = tools[budgeter.num_tool_infos:]
+        if dropped_tools:
+            self.ui.notify(
+                title="TOOLS DROPPED",
+                message="The least relevant tools do not fit the tool info budget: "
+                        + ", ".join(tool.name for tool in dropped_tools))
+        self.prompt_tokens = budgeter.report
+        self.ui.notify(
+            title="PROMPT TOKENS",
+            message=", ".join(f"{k}: {v}" for k, v in self.prompt_tokens.items()))
+
+        inputs = dict(
+            name=self.name,
+            role=self.role,
+            goal=self.goal,
+            related_past_episodes=related_past_episodes,
+            related_knowledge=related_knowledge,
+            task=current_task_description,
+            tool_info=tool_info,
+            recent_episodes=ReasonPrompt.get_recent_episodes(memory)
+        )
+        return inputs, memory
+
+    def _reason(self) -> Union[str, Dict[Any, Any]]:
+        inputs, memory = self._prepare_reasoning()
 
+        # While streaming, thoughts are shown as they complete, and the rest of
+        # the completion is not waited for once the action is complete.
+        streaming_handler = self._start_streaming() if self.stream_reasoning else None
+        try:
+            # If OpenAI Chat is available, it is used for higher accuracy results.
+            if self.openaichat:
+                propmt = ReasonPrompt.get_chat_template(
+                    memory=memory, parallel=self.parallel_actions
+                ).format_prompt(**inputs).to_messages()
+                result = self.openaichat(propmt).content
+
+            else:
+                # Get the result from the LLM
+                llm_chain = self._get_reason_chain(ReasonPrompt.get_template(
+                    memory=memory, parallel=self.parallel_actions))
+                try:
+                    result = llm_chain.predict(**inputs)
+                except ReasoningActionReady:
+                    raise
+                except Exception as e:
+                    raise Exception(f"Error: {e}")
+        except ReasoningActionReady as e:
+            result = json.dumps(e.result)
+        finally:
+            if streaming_handler is not None:
+                self._streaming_model().callback_manager.remove_handler(
+                    streaming_handler)
+
+        return self._parse_reasoning(result)
+
+    async def _areason(self) -> Union[str, Dict[Any, Any]]:
+        """
+        Reason without blocking the event loop.
+        The LLM call is awaited,
+        and the memory retrieval and the parsing run in worker threads.
+        The reasoning is not streamed.
+        """
+        loop = asyncio.get_running_loop()
+        inputs, memory = await loop.run_in_executor(None, self._prepare_reasoning)
+
+        if self.openaichat:
+            propmt = ReasonPrompt.get_chat_template(
+                memory=memory, parallel=self.parallel_actions
+            ).format_prompt(**inputs).to_messages()
+            generations = (await self.openaichat.agenerate([propmt])).generations
+            result = generations[0][0].text
         else:
-            # Get the result from the LLM
-            prompt = ReasonPrompt.get_template(memory=memory)
-            llm_chain = LLMChain(prompt=prompt, llm=self.llm)
+            llm_chain = self._get_reason_chain(ReasonPrompt.get_template(
+                memory=memory, parallel=self.parallel_actions))
             try:
-                result = llm_chain.predict(
-                    name=self.name,
-                    role=self.role,
-                    goal=self.goal,
-                    related_past_episodes=related_past_episodes,
-                    elated_knowledge=related_knowledge,
-                    task=current_task_description,
-                    tool_info=tool_info
-                )
+                result = await llm_chain.apredict(**inputs)
+            except NotImplementedError:
+                # LLMs without async support are called in a worker thread.
+                result = await loop.run_in_executor(
+                    None, functools.partial(llm_chain.predict, **inputs))
             except Exception as e:
                 raise Exception(f"Error: {e}")
 
-        # Parse and validate the result
+        return await loop.run_in_executor(None, self._parse_reasoning, result)
+
+    def _parse_reasoning(self, result: str) -> Union[str, Dict[Any, Any]]:
+        """Parse and validate the reasoning."""
         try:
             result_json_obj = LLMJsonOutputParser.parse_and_validate(
                 json_str=result,
-                json_schema=REASON_JSON_SCHEMA_STR,
-                llm=self.llm
+                json_schema=PARALLEL_REASON_JSON_SCHEMA_STR
+                if self.parallel_actions else REASON_JSON_SCHEMA_STR,
+                llm=self.llm,
+                fill_missing=True
             )
             return result_json_obj
         except Exception as e:
             raise Exception(f"Error: {e}")
 
+    def _get_reason_chain(self, prompt: PromptTemplate) -> LLMChain:
+        """Get the reasoning chain of a template, building it once per template."""
+        if id(prompt) not in self._reason_chains:
+            self._reason_chains[id(prompt)] = LLMChain(prompt=prompt, llm=self.llm)
+        return self._reason_chains[id(prompt)]
+
+    def _streaming_model(self) -> Union[BaseLLM, BaseChatModel]:
+        """Get the model streaming the reasoning tokens."""
+        model = self.openaichat or self.llm
+        # Cached responses are not streamed, only the ones of the wrapped model.
+        if isinstance(model, CachedChatModel):
+            return model.chat_model
+        if isinstance(model, CachedLLM):
+            return model.llm
+        return model
+
+    def _start_streaming(self) -> StreamingJsonCallbackHandler:
+        """Parse the reasoning tokens as the model streams them."""
+        parser = IncrementalJsonParser(
+            on_value=lambda path, value: self._on_streamed_value(parser, path, value))
+        handler = StreamingJsonCallbackHandler(parser)
+        self._streaming_model().callback_manager.add_handler(handler)
+        return handler
+
+    def _on_streamed_value(
+            self, parser: IncrementalJsonParser, path: JsonPath, value: Any) -> None:
+        """
+        Show the streamed thoughts and stop the stream once the action is complete.
+        """
+        action_key = "actions" if self.parallel_actions else "action"
+        if len(path) == 2 and path[0] == "thoughts" and path[1] in THOUGHT_TITLES:
+            self.ui.notify(title=THOUGHT_TITLES[path[1]], message=value)
+            self._streamed_thoughts.add(path[1])
+        elif path == (action_key,) and "thoughts" in parser.value:
+            raise ReasoningActionReady(parser.value)
+
+    def _embed_task(self, task_description: str) -> List[float]:
+        """Embed the task description once per task."""
+        if task_description != self._task_embedding[0]:
+            self._task_embedding = (
+                task_description, self.embeddings.embed_query(task_description))
+        return self._task_embedding[1]
+
+    def _remember_tools(self, task_description: str, task_embedding: List[float],
+                        budgeter: PromptBudgeter) -> List[AgentTool]:
+        """
+        Remember the tools to put in the prompt, selecting the most relevant ones
+        once per task.
+        Without max_tools, every tool is remembered, ordered by relevance when
+        their infos overflow the tool info budget,
+        so the budget drops the least relevant ones.
+        task_complete is part of the prompt template, so it is always available.
+        """
+        tools = self.prodedural_memory.remember_all_tools()
+        if self.max_tools is None:
+            if budgeter.fits_tool_info([tool.get_tool_info() for tool in tools]):
+                return tools
+            k = len(tools)
+        elif len(tools) <= self.max_tools:
+            return tools
+        else:
+            k = self.max_tools
+        # Selections are kept until the task or the catalog changes.
+        key = (task_description, len(tools))
+        if key != self._task_tools[0]:
+            self._task_tools = (
+                key, self.prodedural_memory.remember_relevant_tools_by_vector(
+                    task_embedding, k=k))
+        return self._task_tools[1]
+
+    def _get_action(self, reasoning_result: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Get the action of a reasoning.
+        Several parallel actions are returned as {"actions": [...]}, and
+        task_complete is returned alone, dropping the other actions.
+        """
+        if not self.parallel_actions:
+            return reasoning_result["action"]
+        actions = reasoning_result.get("actions") or [reasoning_result["action"]]
+        for action in actions:
+            if action.get("tool_name") == "task_complete":
+                return action
+        if len(actions) == 1:
+            return actions[0]
+        return {"actions": actions}
+
+    def _run_action(self, action: Dict[str, Any]) -> str:
+        """
+        Run an action, or the independent actions of a step at the same time.
+        The results of parallel actions are merged into one result, and a
+        failed action gets its error as its result.
+        """
+        if "actions" not in action:
+            return self._act(action["tool_name"], action["args"])
+
+        def act(tool_name: str, args: Dict) -> str:
+            try:
+                return self._act(tool_name, args)
+            except Exception as e:
+                return str(e)
+        futures = [
+            self._action_executor.submit(
+                act, a.get("tool_name", ""), a.get("args") or {})
+            for a in action["actions"]]
+        return self._merge_action_results(
+            action["actions"], [future.result() for future in futures])
+
+    async def _arun_action(self, action: Dict[str, Any]) -> str:
+        """
+        Run an action, or the independent actions of a step concurrently,
+        on the event loop.
+        """
+        if "actions" not in action:
+            return await self._aact(action["tool_name"], action["args"])
+
+        async def act(tool_name: str, args: Dict) -> str:
+            try:
+                return await self._aact(tool_name, args)
+            except Exception as e:
+                return str(e)
+        results = await asyncio.gather(
+            *[act(a.get("tool_name", ""), a.get("args") or {})
+              for a in action["actions"]])
+        return self._merge_action_results(action["actions"], results)
+
+    @staticmethod
+    def _merge_action_results(actions: List[Dict[str, Any]], results: List[str]) -> str:
+        """Merge the results of parallel actions into one result."""
+        return "\n".join(
+            f"[{i}] {a.get('tool_name')} {json.dumps(a.get('args'))}:\n{result}"
+            for i, (a, result) in enumerate(zip(actions, results), 1))
+
+    async def _aact(self, tool_name: str, args: Dict) -> str:
+        try:
+            tool = self.prodedural_memory.remember_tool_by_name(tool_name)
+        except Exception as e:
+            raise Exception("Invalid command: " + str(e))
+        try:
+            return await tool.arun(**args)
+        except AgentToolTimeoutError as e:
+            return self._timeout_result(e)
+        except Exception as e:
+            raise Exception("Could not run tool: " + str(e))
+
     def _act(self, tool_name: str, args: Dict) -> str:
         # Get the tool to use from the procedural memory
         try:
@@ -247,9 +807,17 @@ class Agent(BaseModel):
         try:
             result = tool.run(**args)
             return result
+        except AgentToolTimeoutError as e:
+            return self._timeout_result(e)
         except Exception as e:
             raise Exception("Could not run tool: " + str(e))
 
+    @staticmethod
+    def _timeout_result(error: AgentToolTimeoutError) -> str:
+        """Get the result of a timed out tool call, which the agent can reason about."""
+        return json.dumps({"status": "timeout", "tool_name": error.tool_name,
+                           "timeout_seconds": error.timeout, "message": str(error)})
+
     def _task_complete(self, result: str) -> str:
         current_task = self.task_manager.get_current_task_string()
         self.ui.notify(title="COMPLETE TASK",
@@ -286,7 +854,8 @@ class Agent(BaseModel):
             self.role = agent_data["role"]
 
             try:
-                self.semantic_memory.load_local(agent_data["semantic_memory"])
+                self.semantic_memory.load_local(
+                    agent_data["semantic_memory"], mmap=self.mmap_memory)
             except Exception as e:
                 self.ui.notify(
                     "ERROR", "Semantic memory data is corrupted.", title_color="red")
@@ -296,7 +865,8 @@ class Agent(BaseModel):
                     "INFO", "Semantic memory data is loaded.", title_color="GREEN")
 
             try:
-                self.episodic_memory.load_local(agent_data["episodic_memory"])
+                self.episodic_memory.load_local(
+                    agent_data["episodic_memory"], mmap=self.mmap_memory)
             except Exception as e:
                 self.ui.notify(
                     "ERROR", "Episodic memory data is corrupted.", title_color="RED")
@@ -0,0 +1,72 @@
+"""
+Recall and latency benchmark of the ANN vector index tier.
+
+Fills a vector index past its ANN threshold, waits for the IVF index to be
+swapped in, and compares the recall@k and the query latency of the IVF
+index against the flat index holding the same vectors.
+
+Usage (from the src directory):
+    python -m benchmarks.ann_index --sizes 20000 100000 --nprobes 4 16 64
+"""
+import argparse
+import time
+from typing import List, Tuple
+import numpy as np
+from memory.vector_index import VectorIndex
+
+DIM = 768
+
+
+def _fill(size: int, ann_threshold: int, nprobe: int) -> Tuple[VectorIndex, np.ndarray]:
+    """Fill a vector index with clustered random vectors and return both."""
+    rng = np.random.default_rng(0)
+    centers = rng.random((max(1, size // 100), DIM), dtype=np.float32)
+    vectors = centers[rng.integers(0, len(centers), size)]
+    vectors += rng.normal(0, 0.05, (size, DIM)).astype(np.float32)
+    vector_index = VectorIndex(ann_threshold=ann_threshold, ann_nprobe=nprobe)
+    for start in range(0, size, 10000):
+        ids = list(range(start + 1, min(size, start + 10000) + 1))
+        vector_index.add(ids, vectors[start:start + len(ids)])
+    vector_index.wait_for_ann()
+    return vector_index, vectors
+
+
+def _query(vector_index: VectorIndex, queries: np.ndarray,
+           k: int) -> Tuple[List[List[int]], float]:
+    """Search every query and return the ids found and the mean latency in ms."""
+    start = time.perf_counter()
+    results = [[i for i, _ in vector_index.search(query, k=k)] for query in queries]
+    return results, (time.perf_counter() - start) / len(queries) * 1000
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[20000, 100000],
+                        help="The numbers of vectors to benchmark")
+    parser.add_argument("--nprobes", type=int, nargs="+", default=[4, 16, 64],
+                        help="The numbers of IVF lists searched per query")
+    parser.add_argument("--queries", type=int, default=200,
+                        help="The number of queries")
+    parser.add_argument("-k", type=int, default=5,
+                        help="The number of neighbours searched")
+    args = parser.parse_args()
+
+    print(f"{'vectors':>8} {'index':>10} {'recall@k':>9} {'query ms':>9}")
+    for size in args.sizes:
+        flat, vectors = _fill(size, ann_threshold=None, nprobe=0)
+        rng = np.random.default_rng(1)
+        queries = vectors[rng.integers(0, size, args.queries)]
+        queries += rng.normal(0, 0.05, queries.shape).astype(np.float32)
+        expected, latency = _query(flat, queries, args.k)
+        print(f"{size:>8} {'flat':>10} {1.0:9.3f} {latency:9.3f}")
+
+        for nprobe in args.nprobes:
+            ann, _ = _fill(size, ann_threshold=min(size, 20000), nprobe=nprobe)
+            found, latency = _query(ann, queries, args.k)
+            recall = np.mean([len(set(e) & set(f)) / len(e)
+                              for e, f in zip(expected, found)])
+            print(f"{size:>8} {f'ivf/{nprobe}':>10} {recall:9.3f} {latency:9.3f}")
+
+
+if __name__ == "__main__":
+    main()
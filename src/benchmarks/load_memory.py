@@ -0,0 +1,125 @@
+"""
+Load benchmark for persisted episodic memory.
+
+Saves episodic memories of growing size and measures, in a fresh process,
+the time to load them and answer the first top-k query, and the resident
+memory after loading, reading the index into RAM versus memory-mapping it.
+Each memory is measured right after its snapshot is written, and again with
+episodes saved to the write-ahead log since, as a running agent leaves it.
+
+Usage (from the src directory):
+    python -m benchmarks.load_memory --sizes 1000 10000 100000
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import numpy as np
+from memory.episode_log import EpisodeLog, EPISODE_LOG_FILENAME
+from memory.vector_index import VectorIndex
+
+DIM = 768
+
+
+def _build(path: str, size: int) -> None:
+    """Save an episodic memory folder with random episodes."""
+    rng = np.random.default_rng(0)
+    vector_index = VectorIndex()
+    log = EpisodeLog()
+    for start in range(0, size, 10000):
+        count = min(10000, size - start)
+        ids = [log.append(_payload()) for _ in range(count)]
+        vector_index.add(ids, rng.random((count, DIM), dtype=np.float32))
+    vector_index.save_local(path)
+    log.attach(os.path.join(path, EPISODE_LOG_FILENAME))
+
+
+def _append_wal(path: str, count: int) -> None:
+    """Save random episodes to the write-ahead log of a saved episodic memory folder."""
+    rng = np.random.default_rng(1)
+    vector_index = VectorIndex.load_local(path, mmap=True)
+    log = EpisodeLog(os.path.join(path, EPISODE_LOG_FILENAME))
+    ids = [log.append(_payload()) for _ in range(count)]
+    vector_index.add(ids, rng.random((count, DIM), dtype=np.float32))
+    vector_index.save_local(path)
+
+
+def _payload() -> dict:
+    """Get the payload of a random episode."""
+    return {"thoughts": {}, "action": {}, "result": "result", "summary": "summary"}
+
+
+def _rss_mb() -> float:
+    """Get the current resident memory of this process in MB."""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _child(path: str, mmap: bool) -> None:
+    """Load a folder, run one query and print the measurements as JSON."""
+    from langchain.llms.fake import FakeListLLM
+    from memory.episodic_memory import EpisodicMemory
+    memory = EpisodicMemory(llm=FakeListLLM(responses=[""]))
+    start = time.perf_counter()
+    memory.load_local(path, mmap=mmap)
+    loaded = time.perf_counter()
+    rss_mb = _rss_mb()
+    memory.remember_related_episodes_by_vector(np.zeros(DIM).tolist(), k=2)
+    queried = time.perf_counter()
+    print(json.dumps({
+        "mapped": memory.vector_index._mapped_filename is not None,
+        "load": loaded - start,
+        "first_query": queried - loaded,
+        "rss_mb": rss_mb,
+    }))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000],
+                        help="The numbers of episodes to benchmark")
+    parser.add_argument("--wal", type=int, default=100,
+                        help="The number of episodes in the write-ahead log "
+                             "of the second measurement")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    parser.add_argument("--mmap", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        _child(args.child, args.mmap)
+        return
+
+    print(f"{'episodes':>9} {'wal':>5} {'mode':>5} {'mapped':>7} "
+          f"{'load s':>8} {'query s':>8} {'rss MB':>8}")
+    print("(rss is measured after loading, before the first query)")
+    for size in args.sizes:
+        with tempfile.TemporaryDirectory() as path:
+            _build(path, size)
+            for wal in [0, args.wal]:
+                if wal:
+                    _append_wal(path, wal)
+                for mmap in [False, True]:
+                    command = [sys.executable, "-m", "benchmarks.load_memory",
+                               "--child", path]
+                    if mmap:
+                        command.append("--mmap")
+                    output = subprocess.check_output(command)
+                    result = json.loads(output.decode().strip().splitlines()[-1])
+                    mode = "mmap" if mmap else "read"
+                    print(f"{size:>9} {wal:>5} {mode:>5} {str(result['mapped']):>7} "
+                          f"{result['load']:8.3f} {result['first_query']:8.3f} "
+                          f"{result['rss_mb']:8.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""
+Startup benchmark for the embedding model used by the memories.
+
+Compares the cold-start time and resident memory of building the memories
+with one eager HuggingFaceEmbeddings per memory (the previous behaviour)
+against the shared, lazily loaded embeddings.
+
+Usage (from the src directory):
+    python -m benchmarks.startup --agents 2
+"""
+import argparse
+import json
+import resource
+import subprocess
+import sys
+import time
+
+
+def _max_rss_mb() -> float:
+    """Get the peak resident memory of this process in MB."""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _run_eager(num_agents: int) -> None:
+    from langchain.embeddings import HuggingFaceEmbeddings
+    # One model per memory, three memories per agent.
+    embeddings = [HuggingFaceEmbeddings() for _ in range(num_agents * 3)]
+    embeddings[0].embed_query("warm up")
+
+
+def _run_shared(num_agents: int) -> None:
+    from langchain.llms.fake import FakeListLLM
+    from memory.episodic_memory import EpisodicMemory
+    from memory.procedual_memory import ProcedualMemory
+    from memory.semantic_memory import SemanticMemory
+    llm = FakeListLLM(responses=[""])
+    memories = []
+    for _ in range(num_agents):
+        memories.append(ProcedualMemory())
+        memories.append(EpisodicMemory(llm=llm))
+        memories.append(SemanticMemory(llm=llm))
+    memories[0].embeddings.embed_query("warm up")
+
+
+def _child(mode: str, num_agents: int) -> None:
+    """Run one mode and print the measurements as JSON."""
+    start = time.perf_counter()
+    if mode == "eager":
+        _run_eager(num_agents)
+    else:
+        _run_shared(num_agents)
+    elapsed = time.perf_counter() - start
+    print(json.dumps({"seconds": elapsed, "max_rss_mb": _max_rss_mb()}))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--agents", type=int, default=1,
+                        help="The number of agents built in one process")
+    parser.add_argument("--child", choices=["eager", "shared"], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        _child(args.child, args.agents)
+        return
+
+    # Each mode runs in a fresh interpreter so the measurements are cold.
+    results = {}
+    for mode in ["eager", "shared"]:
+        output = subprocess.check_output(
+            [sys.executable, "-m", "benchmarks.startup",
+             "--child", mode, "--agents", str(args.agents)])
+        results[mode] = json.loads(output.decode().strip().splitlines()[-1])
+
+    print(f"agents: {args.agents}")
+    for mode, result in results.items():
+        print(f"{mode:>7}: {result['seconds']:8.2f} s  {result['max_rss_mb']:8.1f} MB")
+    eager, shared = results["eager"], results["shared"]
+    print(f"  saved: {eager['seconds'] - shared['seconds']:8.2f} s  "
+          f"{eager['max_rss_mb'] - shared['max_rss_mb']:8.1f} MB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""
+CPU overhead benchmark of one reasoning step outside the LLM call.
+
+Measures validating the reasoning JSON, building the reasoning prompt and
+chain, and rendering the tool infos, rebuilding everything on each step (the
+previous behaviour) against the compiled schemas, templates and tool infos.
+
+Usage (from the src directory):
+    python -m benchmarks.step_overhead --steps 1000 --tools 20
+"""
+import argparse
+import json
+import time
+from typing import Callable, Dict, List
+import jsonschema
+from langchain import LLMChain
+from langchain.llms.fake import FakeListLLM
+import llm.reason.prompt as ReasonPrompt
+from llm.json_output_parser import compile_schema
+from llm.reason.schema import JsonSchema as ReasonSchema
+from memory.episodic_memory import Episode
+from tools.base import AgentTool
+
+REASON_JSON_SCHEMA_STR = json.dumps(ReasonSchema.schema)
+REASONING = json.loads(REASON_JSON_SCHEMA_STR)
+
+
+def _make_tools(num_tools: int) -> List[AgentTool]:
+    def search(query: str, num_results: int) -> str:
+        return query
+    return [AgentTool(name=f"tool_{i}", func=search, description="Search the web")
+            for i in range(num_tools)]
+
+
+def _rebuilt_step(
+        llm: FakeListLLM, tools: List[AgentTool], memory: List[Episode]) -> None:
+    jsonschema.validate(REASONING, json.loads(REASON_JSON_SCHEMA_STR))
+    ReasonPrompt.clear_template_cache()
+    prompt = ReasonPrompt.get_template(memory=memory)
+    LLMChain(prompt=prompt, llm=llm)
+    tool_info = ""
+    for tool in tools:
+        # Forget the tool info, so the signature is inspected again.
+        tool.clear_tool_info_cache()
+        tool_info += tool.get_tool_info() + "\n"
+
+
+def _compiled_step(llm: FakeListLLM, tools: List[AgentTool], memory: List[Episode],
+                   chains: Dict[int, LLMChain]) -> None:
+    compile_schema(REASON_JSON_SCHEMA_STR)[1].validate(REASONING)
+    prompt = ReasonPrompt.get_template(memory=memory)
+    if id(prompt) not in chains:
+        chains[id(prompt)] = LLMChain(prompt=prompt, llm=llm)
+    tool_info = ""
+    for tool in tools:
+        tool_info += tool.get_tool_info() + "\n"
+
+
+def _time_per_step(step: Callable[[], None], steps: int) -> float:
+    """Run a step and return its CPU time per step in ms."""
+    step()
+    start = time.process_time()
+    for _ in range(steps):
+        step()
+    return (time.process_time() - start) / steps * 1000
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--steps", type=int, default=1000,
+                        help="The number of steps to time")
+    parser.add_argument("--tools", type=int, default=20,
+                        help="The number of tools of the agent")
+    args = parser.parse_args()
+
+    llm = FakeListLLM(responses=[""])
+    tools = _make_tools(args.tools)
+    memory = [Episode(
+        thoughts={"task": "task"}, action={"tool_name": "tool_0"}, result="result")]
+    chains: Dict[int, LLMChain] = {}
+
+    rebuilt = _time_per_step(lambda: _rebuilt_step(llm, tools, memory), args.steps)
+    compiled = _time_per_step(
+        lambda: _compiled_step(llm, tools, memory, chains), args.steps)
+    print(f"{'mode':>9} {'cpu ms/step':>12}")
+    print(f"{'rebuilt':>9} {rebuilt:12.3f}")
+    print(f"{'compiled':>9} {compiled:12.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+"""
+Registration and dispatch benchmark of the procedural memory.
+
+Registers catalogs of tools one at a time, as plugins do, and times the
+registration and the lookup of a tool by the name the LLM writes.
+
+Usage (from the src directory):
+    python -m benchmarks.tool_registry --sizes 100 1000 5000
+"""
+import argparse
+import time
+from typing import List
+from benchmarks.tool_selection import _HashEmbeddings, _make_tools
+from memory.procedual_memory import ProcedualMemory
+
+
+class _CountingEmbeddings(_HashEmbeddings):
+    """Embeddings counting the embedded documents."""
+
+    def __init__(self) -> None:
+        self.num_documents = 0
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        self.num_documents += len(texts)
+        return super().embed_documents(texts)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 1000, 5000],
+                        help="The numbers of tools registered")
+    parser.add_argument("--lookups", type=int, default=10000,
+                        help="The number of lookups")
+    args = parser.parse_args()
+
+    print(f"{'tools':>6} {'register ms/tool':>17} {'embedded':>9} {'lookup us':>10}")
+    for size in args.sizes:
+        tools = _make_tools(size)
+        embeddings = _CountingEmbeddings()
+        memory = ProcedualMemory(embeddings=embeddings)
+        start = time.perf_counter()
+        for tool in tools:
+            memory.memorize_tools([tool])
+        register = (time.perf_counter() - start) / size * 1000
+
+        names = [f" TOOL_{i % size}" for i in range(args.lookups)]
+        start = time.perf_counter()
+        for name in names:
+            memory.remember_tool_by_name(name)
+        lookup = (time.perf_counter() - start) / args.lookups * 1000000
+        print(f"{size:>6} {register:17.3f} {embeddings.num_documents:>9} "
+              f"{lookup:10.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""
+Prompt size and latency benchmark of the tool selection against the catalog size.
+
+Registers catalogs of tools with distinct descriptions and compares putting
+every tool info in the reasoning prompt against selecting the tools most
+relevant to the task with the task embedding, as Agent.max_tools does.
+
+Usage (from the src directory):
+    python -m benchmarks.tool_selection --sizes 10 100 1000 -k 8
+"""
+import argparse
+import hashlib
+import time
+from typing import List
+import numpy as np
+from langchain.embeddings.base import Embeddings
+from llm.prompt_budget import TokenCounter
+from memory.procedual_memory import ProcedualMemory
+from tools.base import AgentTool
+
+DIM = 256
+WORDS = ["search", "weather", "stock", "price", "file", "email", "calendar", "news",
+         "translate", "image", "code", "database", "map", "music", "video", "recipe"]
+
+
+class _HashEmbeddings(Embeddings):
+    """
+    Deterministic embeddings summing a random vector per word,
+    so texts sharing words are close.
+    """
+
+    def _embed(self, text: str) -> List[float]:
+        vector = np.zeros(DIM, dtype=np.float32)
+        for word in text.lower().split():
+            digest = hashlib.sha256(word.encode("utf-8")).digest()
+            seed = int.from_bytes(digest[:4], "little")
+            vector += np.random.default_rng(seed).normal(size=DIM).astype(np.float32)
+        return (vector / (np.linalg.norm(vector) or 1)).tolist()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._embed(text)
+
+
+def _make_tools(num_tools: int) -> List[AgentTool]:
+    def run(query: str) -> str:
+        return query
+    rng = np.random.default_rng(0)
+    return [AgentTool(name=f"tool_{i}", func=run,
+                      description=" ".join(rng.choice(WORDS, 4)) + f" tool number {i}")
+            for i in range(num_tools)]
+
+
+def _tool_info(tools: List[AgentTool]) -> str:
+    return "".join(tool.get_tool_info() + "\n" for tool in tools)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1000],
+                        help="The numbers of tools in the catalog")
+    parser.add_argument("-k", type=int, default=8, help="The number of tools selected")
+    parser.add_argument("--queries", type=int, default=100, help="The number of tasks")
+    args = parser.parse_args()
+
+    embeddings = _HashEmbeddings()
+    counter = TokenCounter()
+    task = "check the weather and the news of the stock price"
+    task_embedding = embeddings.embed_query(task)
+
+    print(f"{'tools':>6} {'mode':>6} {'prompt tokens':>14} {'select ms':>10}")
+    for size in args.sizes:
+        memory = ProcedualMemory(embeddings=embeddings)
+        memory.memorize_tools(_make_tools(size))
+
+        start = time.perf_counter()
+        for _ in range(args.queries):
+            tool_info = _tool_info(memory.remember_all_tools())
+        latency = (time.perf_counter() - start) / args.queries * 1000
+        print(f"{size:>6} {'all':>6} {counter.count(tool_info):>14} {latency:10.3f}")
+
+        start = time.perf_counter()
+        for _ in range(args.queries):
+            tool_info = _tool_info(memory.remember_relevant_tools_by_vector(
+                task_embedding, k=args.k))
+        latency = (time.perf_counter() - start) / args.queries * 1000
+        print(f"{size:>6} {'top-k':>6} {counter.count(tool_info):>14} {latency:10.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,228 @@
+import asyncio
+import functools
+import hashlib
+import json
+import re
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from langchain.chat_models.base import BaseChatModel
+from langchain.llms.base import BaseLLM
+from langchain.schema import (
+    AIMessage,
+    BaseLanguageModel,
+    BaseMessage,
+    ChatGeneration,
+    ChatResult,
+    Generation,
+    LLMResult
+)
+from memory.sqlite_store import SqliteStore
+
+LLM_CACHE_FILENAME = "llm_cache.sqlite3"
+RECORD_MODE = "record"
+REPLAY_MODE = "replay"
+# Parts of the prompts that change on every run and are left out of the cache keys.
+VOLATILE_PROMPT_PATTERNS = [
+    re.compile(r"The current time and date is "
+               r"\w{3} \w{3} [ \d]\d \d\d:\d\d:\d\d \d{4}"),
+    re.compile(r"This result was cached on "
+               r"\w{3} \w{3} [ \d]\d \d\d:\d\d:\d\d \d{4}"),
+]
+
+
+class LLMCacheMissError(Exception):
+    """Exception for a response not recorded in replay mode"""
+    pass
+
+
+class LLMResponseCache(SqliteStore):
+    """
+    LLM responses keyed by the model, its parameters and the rendered prompt.
+    In record mode, missing responses are generated and stored.
+    In replay mode, only recorded responses are served.
+    """
+    schema = """
+        CREATE TABLE IF NOT EXISTS responses (
+            key TEXT PRIMARY KEY,
+            generations TEXT NOT NULL
+        );
+    """
+
+    def __init__(self, path: Optional[str] = None, mode: str = RECORD_MODE) -> None:
+        if mode not in (RECORD_MODE, REPLAY_MODE):
+            raise ValueError(f"Unknown LLM cache mode: {mode}")
+        super().__init__(path)
+        self.mode = mode
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(llm_string: str, prompt: str) -> str:
+        """Get the cache key of a prompt to a model."""
+        for pattern in VOLATILE_PROMPT_PATTERNS:
+            prompt = pattern.sub("", prompt)
+        return hashlib.sha256(f"{llm_string}\0{prompt}".encode("utf-8")).hexdigest()
+
+    def lookup(self, key: str) -> Optional[List[Dict[str, Any]]]:
+        """Look up the recorded generations of a key, raising a miss in replay mode."""
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT generations FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is not None:
+                self.hits += 1
+                return json.loads(row[0])
+            self.misses += 1
+        if self.mode == REPLAY_MODE:
+            raise LLMCacheMissError(f"No response is recorded for the key {key}")
+        return None
+
+    def update(self, key: str, generations: List[Dict[str, Any]]) -> None:
+        """Record the generations of a key."""
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO responses (key, generations) VALUES (?, ?)",
+                (key, json.dumps(generations)))
+            self.conn.commit()
+
+    def get_or_call(self, llm_string: str, prompt: str, func: Callable[[], str]) -> str:
+        """Get the recorded text of a prompt, or call func and record its text."""
+        key = self.make_key(llm_string, prompt)
+        generations = self.lookup(key)
+        if generations is None:
+            generations = [{"text": func()}]
+            self.update(key, generations)
+        return generations[0]["text"]
+
+    def stats(self) -> Dict[str, int]:
+        """Get the hit and miss counters of the cache."""
+        return {"hits": self.hits, "misses": self.misses}
+
+    def __copy__(self) -> "LLMResponseCache":
+        return self
+
+    def __deepcopy__(self, memo: Dict[int, Any]) -> "LLMResponseCache":
+        return self
+
+
+def get_llm_string(model: BaseLanguageModel, stop: Optional[List[str]] = None) -> str:
+    """Get the string identifying a model, its parameters and the stop words."""
+    if isinstance(model, BaseLLM):
+        params = model.dict()
+    else:
+        params = model.dict(exclude={"callback_manager", "verbose", "client"})
+        # Credentials do not change the responses.
+        params = {k: v for k, v in params.items() if not k.endswith("api_key")}
+    params["_class"] = type(model).__name__
+    params["stop"] = stop
+    return json.dumps(params, sort_keys=True, default=str)
+
+
+class CachedLLM(BaseLLM):
+    """LLM serving the responses of another LLM from a response cache."""
+    llm: BaseLLM
+    response_cache: LLMResponseCache
+
+    @property
+    def _llm_type(self) -> str:
+        return self.llm._llm_type
+
+    @property
+    def _identifying_params(self) -> Dict[str, Any]:
+        return self.llm._identifying_params
+
+    def _generate(
+            self, prompts: List[str], stop: Optional[List[str]] = None) -> LLMResult:
+        keys, generations, missing = self._lookup(prompts, stop)
+        result = None
+        if missing:
+            result = self.llm.generate([prompts[i] for i in missing], stop=stop)
+        return self._update(keys, generations, missing, result)
+
+    async def _agenerate(
+            self, prompts: List[str], stop: Optional[List[str]] = None) -> LLMResult:
+        keys, generations, missing = self._lookup(prompts, stop)
+        result = None
+        if missing:
+            missing_prompts = [prompts[i] for i in missing]
+            try:
+                result = await self.llm.agenerate(missing_prompts, stop=stop)
+            except NotImplementedError:
+                # LLMs without async support are called in a worker thread.
+                result = await asyncio.get_running_loop().run_in_executor(
+                    None,
+                    functools.partial(self.llm.generate, missing_prompts, stop=stop))
+        return self._update(keys, generations, missing, result)
+
+    def _lookup(self, prompts: List[str], stop: Optional[List[str]]
+                ) -> Tuple[List[str], List[Any], List[int]]:
+        """
+        Get the keys and the recorded generations of the prompts, with the indexes of
+        the missing ones.
+        """
+        llm_string = get_llm_string(self.llm, stop)
+        keys = [self.response_cache.make_key(llm_string, prompt) for prompt in prompts]
+        generations = [self.response_cache.lookup(key) for key in keys]
+        missing = [i for i, generation in enumerate(generations) if generation is None]
+        return keys, generations, missing
+
+    def _update(self, keys: List[str], generations: List[Any], missing: List[int],
+                result: Optional[LLMResult]) -> LLMResult:
+        """
+        Record the generations of the missing prompts,
+        and get the result of all the prompts.
+        """
+        llm_output = None
+        if result is not None:
+            llm_output = result.llm_output
+            for i, new_generations in zip(missing, result.generations):
+                generations[i] = [
+                    {"text": g.text, "generation_info": g.generation_info}
+                    for g in new_generations]
+                self.response_cache.update(keys[i], generations[i])
+        return LLMResult(
+            generations=[[Generation(**g) for g in generation]
+                         for generation in generations],
+            llm_output=llm_output)
+
+
+class CachedChatModel(BaseChatModel):
+    """Chat model serving the responses of another chat model from a response cache."""
+    chat_model: BaseChatModel
+    response_cache: LLMResponseCache
+
+    def _generate(self, messages: List[BaseMessage],
+                  stop: Optional[List[str]] = None) -> ChatResult:
+        key, generations = self._lookup(messages, stop)
+        if generations is None:
+            generations = self._update(
+                key, self.chat_model._generate(messages, stop=stop))
+        return self._to_result(generations)
+
+    async def _agenerate(self, messages: List[BaseMessage],
+                         stop: Optional[List[str]] = None) -> ChatResult:
+        key, generations = self._lookup(messages, stop)
+        if generations is None:
+            generations = self._update(
+                key, await self.chat_model._agenerate(messages, stop=stop))
+        return self._to_result(generations)
+
+    def _lookup(self, messages: List[BaseMessage], stop: Optional[List[str]]
+                ) -> Tuple[str, Optional[List[Dict[str, Any]]]]:
+        prompt = json.dumps(
+            [{"type": m.type, "content": m.content} for m in messages])
+        key = self.response_cache.make_key(
+            get_llm_string(self.chat_model, stop), prompt)
+        return key, self.response_cache.lookup(key)
+
+    def _update(self, key: str, result: ChatResult) -> List[Dict[str, Any]]:
+        generations = [
+            {"text": g.message.content, "generation_info": g.generation_info}
+            for g in result.generations]
+        self.response_cache.update(key, generations)
+        return generations
+
+    @staticmethod
+    def _to_result(generations: List[Dict[str, Any]]) -> ChatResult:
+        return ChatResult(generations=[
+            ChatGeneration(message=AIMessage(content=g["text"]),
+                           generation_info=g["generation_info"])
+            for g in generations])
@@ -0,0 +1,46 @@
+from typing import Iterator
+from llm.prompt_budget import CHARS_PER_TOKEN, TokenCounter
+
+DEFAULT_CHUNK_TOKENS = 1000
+DEFAULT_EXCERPT_TOKENS = 500
+EXCERPT_GAP_NOTE = "\n...[{omitted} tokens omitted]...\n"
+
+
+def iter_chunks(text: str, max_tokens: int, counter: TokenCounter) -> Iterator[str]:
+    """
+    Split a text into chunks of at most max_tokens tokens, yielding them when cut.
+    Chunks end at line breaks, and only lines longer than a chunk are cut inside.
+    """
+    chunk = ""
+    for line in text.splitlines(keepends=True):
+        if counter.count(chunk + line) <= max_tokens:
+            chunk += line
+            continue
+        if chunk:
+            yield chunk
+            chunk = ""
+        while counter.count(line) > max_tokens:
+            # Cut the line where the chunk is full, estimating the characters of
+            # the tokens first.
+            cut = max_tokens * CHARS_PER_TOKEN
+            while cut > 1 and counter.count(line[:cut]) > max_tokens:
+                cut = cut * 3 // 4
+            yield line[:cut]
+            line = line[cut:]
+        chunk = line
+    if chunk:
+        yield chunk
+
+
+def make_excerpt(text: str, max_tokens: int, counter: TokenCounter) -> str:
+    """
+    Get the head and the tail of a text within max_tokens tokens,
+    noting how much was left out.
+    """
+    num_tokens = counter.count(text)
+    if num_tokens <= max_tokens:
+        return text
+    head = counter.truncate(text, max_tokens // 2, mark="")
+    tail = counter.truncate(text[::-1], max_tokens - max_tokens // 2, mark="")[::-1]
+    omitted = num_tokens - counter.count(head) - counter.count(tail)
+    return head + EXCERPT_GAP_NOTE.format(omitted=max(0, omitted)) + tail
@@ -0,0 +1,22 @@
+from functools import lru_cache
+from langchain.prompts import PromptTemplate
+
+BASE_TEMPLATE = """
+[EVENTS]
+{summaries}
+
+[INSTRUSCTION]
+The above [EVENTS] are summaries of past events in chronological order.
+Please consolidate them into one summary that keeps the facts, decisions and results
+needed to recall these events later.
+
+[SUMMARY]
+"""
+
+
+@lru_cache(maxsize=None)
+def get_template() -> PromptTemplate:
+    template = BASE_TEMPLATE
+    prompt_template = PromptTemplate(
+        input_variables=["summaries"], template=template)
+    return prompt_template
@@ -1,6 +1,8 @@
 import json
+from functools import lru_cache
 from langchain.prompts import PromptTemplate, ChatPromptTemplate
-from llm.extract_entity.schema import JsonSchema
+from typing import List
+from llm.extract_entity.schema import BatchJsonSchema, JsonSchema
 from langchain.prompts.chat import (
     ChatPromptTemplate,
     SystemMessagePromptTemplate,
@@ -8,6 +10,7 @@ from langchain.prompts.chat import (
 
 # Convert the schema object to a string
 JSON_SCHEMA_STR = json.dumps(JsonSchema.schema)
+BATCH_JSON_SCHEMA_STR = json.dumps(BatchJsonSchema.schema)
 
 ENTITY_EXTRACTION_TEMPLATE = """
     You are an AI assistant reading a input text and trying to extract entities from it.
@@ -34,6 +37,38 @@ ENTITY_EXTRACTION_TEMPLATE = """
     {text}
     """
 
+BATCH_ENTITY_EXTRACTION_TEMPLATE = """
+    You are an AI assistant reading numbered input texts and trying to extract
+    entities from each of them.
+    Extract ONLY proper nouns from the input texts and return them as a JSON object
+    keyed by the number of the text they were found in.
+    You should definitely extract all names and places.
+    Return an empty object for a text without entities.
+
+    [EXAMPLE]
+    INPUT TEXTS:
+     [1] Apple Computer was founded on April 1, 1976, by Steve Wozniak, Steve Jobs
+     and Ronald Wayne to develop and sell Wozniak's Apple I personal computer.
+     [2] The file was saved.
+     [3] Tokyo is the capital of Japan and its largest city.
+    RESPONCE:
+     {{
+        "1": {{
+            "Apple Computer Company": "a personal computer company founded in 1976",
+            "Steve Wozniak": "an American inventor who co-founded Apple Computer",
+            "Steve Jobs": "an American entrepreneur who co-founded Apple Computer",
+            "Ronald Wayne": "an American retired worker who co-founded Apple Computer"
+        }},
+        "2": {{}},
+        "3": {{
+            "Tokyo": "the capital and largest city of Japan",
+            "Japan": "an island country in East Asia whose capital is Tokyo"
+        }}
+    }}
+    [INPUT TEXTS] (for reference only):
+    {texts}
+    """
+
 SCHEMA_TEMPLATE = f"""
     [RULE]
     Your response must be provided exclusively in the JSON format outlined below, without any exceptions. 
@@ -49,15 +84,41 @@ SCHEMA_TEMPLATE = f"""
 
     [RESPONSE]""".replace("{", "{{").replace("}", "}}")
 
+BATCH_SCHEMA_TEMPLATE = SCHEMA_TEMPLATE.replace(
+    JSON_SCHEMA_STR.replace("{", "{{").replace("}", "}}"),
+    BATCH_JSON_SCHEMA_STR.replace("{", "{{").replace("}", "}}"))
+
 
+@lru_cache(maxsize=None)
 def get_template() -> PromptTemplate:
     template = f"{ENTITY_EXTRACTION_TEMPLATE}\n{SCHEMA_TEMPLATE}"
     return PromptTemplate(input_variables=["text"], template=template)
 
 
+@lru_cache(maxsize=None)
 def get_chat_template() -> ChatPromptTemplate:
     messages = []
     messages.append(SystemMessagePromptTemplate.from_template(
         ENTITY_EXTRACTION_TEMPLATE))
     messages.append(SystemMessagePromptTemplate.from_template(SCHEMA_TEMPLATE))
     return ChatPromptTemplate.from_messages(messages)
+
+
+def format_texts(texts: List[str]) -> str:
+    """Number the texts for the {texts} variable of the batch templates."""
+    return "\n".join(f"[{i}] {text}" for i, text in enumerate(texts, 1))
+
+
+@lru_cache(maxsize=None)
+def get_batch_template() -> PromptTemplate:
+    template = f"{BATCH_ENTITY_EXTRACTION_TEMPLATE}\n{BATCH_SCHEMA_TEMPLATE}"
+    return PromptTemplate(input_variables=["texts"], template=template)
+
+
+@lru_cache(maxsize=None)
+def get_batch_chat_template() -> ChatPromptTemplate:
+    messages = []
+    messages.append(SystemMessagePromptTemplate.from_template(
+        BATCH_ENTITY_EXTRACTION_TEMPLATE))
+    messages.append(SystemMessagePromptTemplate.from_template(BATCH_SCHEMA_TEMPLATE))
+    return ChatPromptTemplate.from_messages(messages)
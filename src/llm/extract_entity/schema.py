@@ -4,3 +4,21 @@ class JsonSchema:
         "entity2": "description of entity2. Please describe the entities using sentences rather than single words.",
         "entity3": "description of entity3. Please describe the entities using sentences rather than single words."
     }
+
+
+class BatchJsonSchema:
+    schema = {
+        "1": {
+            "entity1": "description of entity1 found in the input text 1. "
+                       "Please describe the entities using sentences rather than "
+                       "single words.",
+            "entity2": "description of entity2 found in the input text 1. "
+                       "Please describe the entities using sentences rather than "
+                       "single words."
+        },
+        "2": {
+            "entity3": "description of entity3 found in the input text 2. "
+                       "Please describe the entities using sentences rather than "
+                       "single words."
+        }
+    }
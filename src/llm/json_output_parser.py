@@ -1,11 +1,22 @@
 import json
-import re
-from typing import Any, Dict, Union, List
+from typing import Any, Dict, Optional, Tuple, Union, List
 from pydantic import BaseModel
-from jsonschema import validate, ValidationError
+from functools import lru_cache
+from jsonschema import ValidationError
+from jsonschema.validators import validator_for
 from langchain.llms.base import BaseLLM
 import contextlib
 from marvin import ai_fn
+from llm.cache import CachedLLM
+from llm.json_repair import (
+    JsonRepairError,
+    coerce_to_schema,
+    count_repair,
+    repair_json,
+    schema_template,
+)
+
+AUTO_FIX_JSON_LLM_STRING = "marvin.auto_fix_json"
 
 
 class LLMJsonOutputParserException(Exception):
@@ -28,6 +39,18 @@ class FixJsonException(LLMJsonOutputParserException):
     pass
 
 
+@lru_cache(maxsize=None)
+def compile_schema(json_schema: str) -> Tuple[Any, Any, Optional[Dict[str, Any]]]:
+    """
+    Compile a JSON schema string once.
+    Returns the schema object, its validator and its template if it is example-shaped.
+    """
+    schema_obj = json.loads(json_schema)
+    validator_class = validator_for(schema_obj)
+    validator_class.check_schema(schema_obj)
+    return schema_obj, validator_class(schema_obj), schema_template(schema_obj)
+
+
 @ai_fn()
 def auto_fix_json(json_str: str, schema: str) -> str:
     """
@@ -50,9 +73,12 @@ def auto_fix_json(json_str: str, schema: str) -> str:
 class LLMJsonOutputParser(BaseModel):
     """Parse the output of the LLM."""
     @classmethod
-    def parse_and_validate(cls, json_str: str, json_schema: str, llm: BaseLLM) -> Union[str, Dict[Any, Any]]:
+    def parse_and_validate(cls, json_str: str, json_schema: str, llm: BaseLLM,
+                           fill_missing: bool = False) -> Union[str, Dict[Any, Any]]:
         """
         Parses and validates the JSON string.
+        With fill_missing, keys missing from an example-shaped schema
+        are filled with empty values.
         """
         # Parse JSON
         try:
@@ -62,61 +88,63 @@ class LLMJsonOutputParser(BaseModel):
 
         # Validate JSON
         try:
-            return cls._validate_json(json_str, json_schema, llm)
+            return cls._validate_json(json_str, json_schema, llm, fill_missing)
         except ValidationError as e:
             raise ValidateJsonException(str(e))
 
-    @classmethod
-    def _remove_square_brackets(cls, json_str: str) -> str:
-        """
-        Removes square brackets from the JSON string.
-        """
-        return re.sub(r"\[|\]", "", json_str)
-
     @classmethod
     def _parse_json(cls, json_str: str,  json_schema: str, llm: BaseLLM) -> Union[str, Dict[Any, Any]]:
         """
         Parses the JSON string.
         """
         with contextlib.suppress(json.JSONDecodeError):
-            json_str = json_str.replace("\t", "")
-            return json.loads(json_str)
+            json_obj = json.loads(json_str.replace("\t", ""))
+            count_repair("strict")
+            return json_obj
 
-        with contextlib.suppress(json.JSONDecodeError):
-            json_str = cls.correct_json(json_str)
-            return json.loads(json_str)
+        # Repair the JSON locally
+        schema_obj, _, template = compile_schema(json_schema)
+        expect_object = isinstance(template, dict) or \
+            (isinstance(schema_obj, dict) and schema_obj.get("type") == "object")
+        with contextlib.suppress(JsonRepairError):
+            json_obj, repairs = repair_json(json_str, expect_object)
+            count_repair("local_repair")
+            for repair in repairs:
+                count_repair(f"local_repair.{repair}")
+            return json_obj
 
-        try:
-            json_str = cls._remove_square_brackets(json_str)
-            brace_index = json_str.index("{")
-            maybe_fixed_json = json_str[brace_index:]
-            last_brace_index = maybe_fixed_json.rindex("}")
-            maybe_fixed_json = maybe_fixed_json[: last_brace_index + 1]
-            return json.loads(maybe_fixed_json)
-        except (json.JSONDecodeError, ValueError):
-            pass
-        # Now try to fix this up using the ai_functions
+        # Now try to fix this up using the ai_functions as a last resort
         try:
             ai_fixed_json = cls._fix_json(json_str, json_schema, llm)
+            count_repair("llm_fix")
             return json.loads(ai_fixed_json)
         except FixJsonException as e:
+            count_repair("failed")
             raise ParseJsonException("Could not parse JSON:" + str(e))
 
     @classmethod
-    def _validate_json(cls, json_obj: Union[str, Dict[Any, Any]], json_schema: str, llm: BaseLLM) -> Union[str, Dict[Any, Any]]:
+    def _validate_json(cls, json_obj: Union[str, Dict[Any, Any]], json_schema: str,
+                       llm: BaseLLM,
+                       fill_missing: bool = False) -> Union[str, Dict[Any, Any]]:
         """
         Check if the given JSON string is fully complient with the provided schema.
         """
-        schema_obj = json.loads(json_schema)
+        _, validator, template = compile_schema(json_schema)
+        if template is not None:
+            json_obj, coerced = coerce_to_schema(json_obj, template, fill_missing)
+            if coerced:
+                count_repair("schema_coercion")
         try:
-            validate(json_obj, schema_obj)
+            validator.validate(json_obj)
             return json_obj
         except ValidationError:
             # Now try to fix this up using the ai_functions
             try:
                 ai_fixed_json = cls._fix_json(json.dumps(json_obj), json_schema, llm)
+                count_repair("llm_fix")
                 return json.loads(ai_fixed_json)
             except FixJsonException as e:
+                count_repair("failed")
                 raise ValidateJsonException("Could not validate JSON:" + str(e))
 
     @staticmethod
@@ -125,7 +153,14 @@ class LLMJsonOutputParser(BaseModel):
         Fix the given JSON string to make it parseable and fully complient with the provided schema.
         """
         try:
-            fixed_json_str = auto_fix_json(json_str, schema)
+            if isinstance(llm, CachedLLM):
+                # The marvin call does not go through the llm,
+                # so its response is cached separately.
+                fixed_json_str = llm.response_cache.get_or_call(
+                    AUTO_FIX_JSON_LLM_STRING, f"{json_str}\0{schema}",
+                    lambda: auto_fix_json(json_str, schema))
+            else:
+                fixed_json_str = auto_fix_json(json_str, schema)
         except Exception as e:
             raise FixJsonException(e)
         try:
@@ -135,92 +170,3 @@ class LLMJsonOutputParser(BaseModel):
             import traceback
             call_stack = traceback.format_exc()
             raise FixJsonException(f"Failed to fix JSON: '{json_str}' " + call_stack)
-
-    @staticmethod
-    def _extract_char_position(error_message: str) -> int:
-        """
-        Extract the character position from the error message.
-        """
-        char_pattern = re.compile(r'\(char (\d+)\)')
-        if match := char_pattern.search(error_message):
-            return int(match[1])
-        else:
-            raise ValueError("Character position not found in the error message.")
-
-    @staticmethod
-    def _add_quotes_to_property_names(json_string: str) -> str:
-        """
-        Add quotes to the property names in the JSON string.
-        """
-        def replace_func(match):
-            return f'"{match.group(1)}":'
-
-        property_name_pattern = re.compile(r'(\w+):')
-        corrected_json_string = property_name_pattern.sub(
-            replace_func,
-            json_string)
-
-        try:
-            json.loads(corrected_json_string)
-            return corrected_json_string
-        except json.JSONDecodeError as e:
-            raise e
-
-    @staticmethod
-    def _balance_braces(json_string: str) -> str:
-        """
-        Add missing braces to the end of the JSON string.
-        """
-        open_braces_count = json_string.count("{")
-        close_braces_count = json_string.count("}")
-
-        while open_braces_count > close_braces_count:
-            json_string += "}"
-            close_braces_count += 1
-
-        while close_braces_count > open_braces_count:
-            json_string = json_string.rstrip("}")
-            close_braces_count -= 1
-
-        with contextlib.suppress(json.JSONDecodeError):
-            json.loads(json_string)
-            return json_string
-
-    @classmethod
-    def _fix_invalid_escape(cls, json_str: str, error_message: str) -> str:
-        """
-        Remove the invalid escape character from the JSON string.
-        """
-        while error_message.startswith('Invalid \\escape'):
-            bad_escape_location = cls._extract_char_position(error_message)
-            json_str = json_str[:bad_escape_location] + \
-                json_str[bad_escape_location + 1:]
-            try:
-                json.loads(json_str)
-                return json_str
-            except json.JSONDecodeError as e:
-                error_message = str(e)
-        return json_str
-
-    @classmethod
-    def correct_json(cls, json_str: str) -> str:
-        """
-        Correct the given JSON string to make it parseable.
-        """
-        try:
-            json.loads(json_str)
-            return json_str
-        except json.JSONDecodeError as e:
-            error_message = str(e)
-            if error_message.startswith('Invalid \\escape'):
-                json_str = cls._fix_invalid_escape(json_str, error_message)
-            if error_message.startswith('Expecting property name enclosed in double quotes'):
-                json_str = cls._add_quotes_to_property_names(json_str)
-                try:
-                    json.loads(json_str)
-                    return json_str
-                except json.JSONDecodeError as e:
-                    error_message = str(e)
-            if balanced_str := cls._balance_braces(json_str):
-                return balanced_str
-        return json_str
@@ -0,0 +1,348 @@
+import json
+import re
+import threading
+from collections import Counter
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+_ESCAPES = {
+    '"': '"', "\\": "\\", "/": "/", "b": "\b", "f": "\f", "n": "\n", "r": "\r",
+    "t": "\t", "'": "'"}
+_PYTHON_LITERALS = {"True": True, "False": False, "None": None}
+_JSON_LITERALS = {"true": True, "false": False, "null": None}
+# A quoted key after a closing quote, when the comma between them is missing
+_NEXT_KEY = re.compile(r"""("[^"\\\n]*"|'[^'\\\n]*')\s*:""")
+
+_repair_counts: Counter = Counter()
+_repair_counts_lock = threading.Lock()
+
+
+class JsonRepairError(Exception):
+    """Exception for text with no JSON to repair"""
+    pass
+
+
+def count_repair(name: str) -> None:
+    """Count one use of a repair path."""
+    with _repair_counts_lock:
+        _repair_counts[name] += 1
+
+
+def get_repair_stats() -> Dict[str, int]:
+    """Get how often each repair path fired."""
+    with _repair_counts_lock:
+        return dict(_repair_counts)
+
+
+def reset_repair_stats() -> None:
+    """Reset the repair counters."""
+    with _repair_counts_lock:
+        _repair_counts.clear()
+
+
+class _TolerantParser:
+    """
+    Single-pass JSON parser accepting the mistakes LLMs make.
+    Each mistake it gets past is recorded in repairs.
+    """
+
+    def __init__(self, text: str) -> None:
+        self.text = text
+        self.pos = 0
+        self.repairs: Set[str] = set()
+
+    def parse(self, expect_object: bool = False) -> Any:
+        start = self._find_start(0, expect_object)
+        while True:
+            if start == -1:
+                raise JsonRepairError("No JSON object or array in the text")
+            self.pos = start
+            self.repairs = set()
+            value = self._value()
+            if expect_object or not self._is_header(value):
+                break
+            # A bracketed header of the prompt, such as [RESPONSE], echoed before
+            # the JSON
+            start = self._find_start(self.pos, expect_object)
+        if self.text[:start].strip():
+            # Prose or a code fence before the JSON
+            self.repairs.add("leading_text")
+        if self.text[self.pos:].strip():
+            self.repairs.add("trailing_text")
+        return value
+
+    def _find_start(self, pos: int, expect_object: bool) -> int:
+        """Find where the JSON starts from pos, or -1."""
+        if expect_object:
+            return self.text.find("{", pos)
+        starts = [i for i in (self.text.find("{", pos), self.text.find("[", pos))
+                  if i != -1]
+        return min(starts) if starts else -1
+
+    def _is_header(self, value: Any) -> bool:
+        """Whether a parsed value is a lone bare word in brackets."""
+        return isinstance(value, list) and len(value) == 1 \
+            and isinstance(value[0], str) and "unquoted_value" in self.repairs
+
+    def _eof(self) -> bool:
+        return self.pos >= len(self.text)
+
+    def _skip_whitespace(self) -> None:
+        while not self._eof() and self.text[self.pos].isspace():
+            self.pos += 1
+
+    def _peek(self) -> str:
+        self._skip_whitespace()
+        return "" if self._eof() else self.text[self.pos]
+
+    def _value(self) -> Any:
+        char = self._peek()
+        if not char:
+            self.repairs.add("truncated")
+            return None
+        if char == "{":
+            return self._object()
+        if char == "[":
+            return self._array()
+        if char in "\"'":
+            return self._string(char)
+        return self._literal()
+
+    def _object(self) -> Dict[str, Any]:
+        self.pos += 1
+        obj: Dict[str, Any] = {}
+        while True:
+            char = self._peek()
+            if not char:
+                self.repairs.add("truncated")
+                return obj
+            if char in "}]":
+                if char == "]":
+                    self.repairs.add("mismatched_bracket")
+                self.pos += 1
+                return obj
+            if char == ",":
+                self.pos += 1
+                self.repairs.add("trailing_comma")
+                continue
+            key = self._key()
+            if not key:
+                self.repairs.add("empty_key")
+            if self._peek() == ":":
+                self.pos += 1
+            else:
+                self.repairs.add("missing_colon")
+            obj[key] = self._value()
+            char = self._peek()
+            if char == ",":
+                self.pos += 1
+                if self._peek() == "}":
+                    self.repairs.add("trailing_comma")
+            elif char and char not in "}]":
+                self.repairs.add("missing_comma")
+
+    def _key(self) -> str:
+        char = self.text[self.pos]
+        if char in "\"'":
+            return self._string(char)
+        start = self.pos
+        while not self._eof() and self.text[self.pos] not in ":,}" \
+                and not self.text[self.pos].isspace():
+            self.pos += 1
+        self.repairs.add("unquoted_key")
+        return self.text[start:self.pos]
+
+    def _array(self) -> List[Any]:
+        self.pos += 1
+        array: List[Any] = []
+        while True:
+            char = self._peek()
+            if not char:
+                self.repairs.add("truncated")
+                return array
+            if char in "]}":
+                if char == "}":
+                    self.repairs.add("mismatched_bracket")
+                self.pos += 1
+                return array
+            if char == ",":
+                self.pos += 1
+                self.repairs.add("trailing_comma")
+                continue
+            array.append(self._value())
+            char = self._peek()
+            if char == ",":
+                self.pos += 1
+                if self._peek() == "]":
+                    self.repairs.add("trailing_comma")
+            elif char and char not in "]}":
+                self.repairs.add("missing_comma")
+
+    def _string(self, quote: str) -> str:
+        if quote == "'":
+            self.repairs.add("single_quotes")
+        self.pos += 1
+        chars: List[str] = []
+        while not self._eof():
+            char = self.text[self.pos]
+            if char == "\\":
+                escape = self.text[self.pos + 1:self.pos + 2]
+                if escape in _ESCAPES:
+                    chars.append(_ESCAPES[escape])
+                    self.pos += 2
+                elif escape == "u" and self._is_hex(
+                        self.text[self.pos + 2:self.pos + 6]):
+                    chars.append(chr(int(self.text[self.pos + 2:self.pos + 6], 16)))
+                    self.pos += 6
+                else:
+                    # The backslash of an invalid escape is kept as a character.
+                    self.repairs.add("bad_escape")
+                    chars.append(char)
+                    self.pos += 1
+            elif char == quote:
+                self.pos += 1
+                if self._ends_string():
+                    return "".join(chars)
+                # A quote inside the string that should have been escaped
+                self.repairs.add("unescaped_quote")
+                chars.append(char)
+            else:
+                chars.append(char)
+                self.pos += 1
+        self.repairs.add("truncated")
+        return "".join(chars)
+
+    @staticmethod
+    def _is_hex(text: str) -> bool:
+        return len(text) == 4 and all(c in "0123456789abcdefABCDEF" for c in text)
+
+    def _ends_string(self) -> bool:
+        """
+        Whether a closing quote at the position is followed by what can come
+        after a string, or by the next key with the comma before it missing.
+        """
+        rest = self.text[self.pos:]
+        stripped = rest.lstrip()
+        if not stripped or stripped[0] in ",:}]":
+            return True
+        return len(stripped) < len(rest) and _NEXT_KEY.match(stripped) is not None
+
+    def _literal(self) -> Any:
+        start = self.pos
+        while not self._eof() and self.text[self.pos] not in ",}]\n":
+            # A quote after whitespace starts the next key when the comma is missing.
+            if self.text[self.pos].isspace() \
+                    and self.text[self.pos + 1:self.pos + 2] in ("\"", "'"):
+                break
+            self.pos += 1
+        token = self.text[start:self.pos].strip()
+        if token in _JSON_LITERALS:
+            return _JSON_LITERALS[token]
+        if token in _PYTHON_LITERALS:
+            self.repairs.add("python_literal")
+            return _PYTHON_LITERALS[token]
+        try:
+            return json.loads(token)
+        except json.JSONDecodeError:
+            self.repairs.add("unquoted_value")
+            return token
+
+
+def repair_json(text: str, expect_object: bool = False) -> Tuple[Any, Set[str]]:
+    """
+    Parse JSON the way LLMs tend to write it,
+    and return the value with the repairs it took.
+    Handles prose, code fences and bracketed headers around the JSON, single quotes,
+    unquoted keys and values, missing and trailing commas, truncated objects
+    and invalid escapes.
+    With expect_object, the JSON starts at the first "{".
+    Raises JsonRepairError when the repair yields an empty key, as it went wrong.
+    """
+    parser = _TolerantParser(text)
+    value = parser.parse(expect_object)
+    if "empty_key" in parser.repairs:
+        raise JsonRepairError("The repaired JSON has an empty key")
+    return value, parser.repairs
+
+
+def _normalize_key(key: str) -> str:
+    return "".join(c for c in str(key).casefold() if c.isalnum())
+
+
+def _is_free_form(template: Dict[str, Any]) -> bool:
+    """Whether a template object only shows placeholder keys, such as "arg name"."""
+    return any(" " in key for key in template)
+
+
+def coerce_to_schema(
+        value: Any, template: Any, fill_missing: bool = False) -> Tuple[Any, bool]:
+    """
+    Coerce a parsed value to the shape of an example-shaped schema like ReasonSchema.
+    Keys are matched ignoring case and punctuation, objects encoded as strings are
+    decoded, lone objects
+ are wrapped in the lists the template expects, and scalars
+    are turned into the strings the template expects. With fill_missing, missing keys
+    get an empty value of their template type.
+    Returns the value and whether it changed.
+    """
+    if isinstance(template, dict):
+        if isinstance(value, list) and len(value) == 1 and isinstance(value[0], dict):
+            coerced, _ = coerce_to_schema(value[0], template, fill_missing)
+            return coerced, True
+        if isinstance(value, str):
+            try:
+                decoded, _ = repair_json(value, expect_object=True)
+            except JsonRepairError:
+                return value, False
+            if isinstance(decoded, dict):
+                coerced, _ = coerce_to_schema(decoded, template, fill_missing)
+                return coerced, True
+            return value, False
+        if not isinstance(value, dict) or _is_free_form(template):
+            return value, False
+
+        changed = False
+        template_keys = {_normalize_key(key): key for key in template}
+        coerced: Dict[str, Any] = {}
+        for key, item in value.items():
+            template_key = key if key in template \
+                else template_keys.get(_normalize_key(key))
+            if template_key is None:
+                coerced[key] = item
+                continue
+            coerced[template_key], item_changed = coerce_to_schema(
+                item, template[template_key], fill_missing)
+            changed = changed or item_changed or template_key != key
+        if fill_missing:
+            for key, item_template in template.items():
+                if key not in coerced:
+                    coerced[key] = {} if isinstance(item_template, dict) else [] \
+                        if isinstance(item_template, list) else ""
+                    changed = True
+        return coerced, changed
+
+    if isinstance(template, list) and template:
+        # A lone item is wrapped in a list,
+        # and items are coerced to the first item of the template.
+        if isinstance(value, dict):
+            coerced, _ = coerce_to_schema(value, template[0], fill_missing)
+            return [coerced], True
+        if isinstance(value, list):
+            items = [coerce_to_schema(item, template[0], fill_missing)
+                     for item in value]
+            return [item for item, _ in items], any(changed for _, changed in items)
+        return value, False
+
+    if isinstance(template, str) and not isinstance(value, str):
+        if value is None:
+            return "", True
+        if isinstance(value, (dict, list)):
+            return json.dumps(value), True
+        return str(value), True
+    return value, False
+
+
+def schema_template(schema: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    """Get the schema as a template if it is example-shaped, not a JSON Schema."""
+    if not isinstance(schema, dict) or "type" in schema or "properties" in schema:
+        return None
+    return schema
@@ -0,0 +1,145 @@
+from typing import Any, Dict, List, Optional
+from pydantic import BaseModel, Field
+from memory.episodic_memory import Episode
+
+DEFAULT_TOKEN_MODEL_NAME = "gpt-3.5-turbo"
+# Characters per token when tiktoken is not installed
+CHARS_PER_TOKEN = 4
+TRUNCATION_MARK = "..."
+
+
+class TokenCounter:
+    """
+    Counts tokens locally with tiktoken if it is installed,
+    otherwise estimates them from the number of characters.
+    """
+
+    def __init__(self, model_name: str = DEFAULT_TOKEN_MODEL_NAME) -> None:
+        self.model_name = model_name
+        self.encoding = None
+        try:
+            import tiktoken
+        except ImportError:
+            return
+        try:
+            self.encoding = tiktoken.encoding_for_model(model_name)
+        except KeyError:
+            self.encoding = tiktoken.get_encoding("cl100k_base")
+
+    def count(self, text: str) -> int:
+        """Count the tokens of a text."""
+        if self.encoding is not None:
+            return len(self.encoding.encode(text))
+        return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+    def truncate(self, text: str, max_tokens: int, mark: str = TRUNCATION_MARK) -> str:
+        """Truncate a text to at most max_tokens tokens, ending it with mark if cut."""
+        if self.count(text) <= max_tokens:
+            return text
+        max_tokens = max(0, max_tokens - self.count(mark)) if mark else max_tokens
+        if self.encoding is not None:
+            return self.encoding.decode(self.encoding.encode(text)[:max_tokens]) + mark
+        return text[:max_tokens * CHARS_PER_TOKEN] + mark
+
+
+class PromptBudget(BaseModel):
+    """Token budgets of the variable sections of the reasoning prompt."""
+    related_knowledge: int = Field(
+        500, description="The tokens of the related knowledge")
+    related_past_episodes: int = Field(
+        800, description="The tokens of the related past episodes")
+    recent_episodes: int = Field(1000, description="The tokens of the recent episodes")
+    tool_info: int = Field(1000, description="The tokens of the tool infos")
+
+
+class PromptBudgeter:
+    """
+    Fits the sections of the reasoning prompt into their token budgets.
+    Items are expected in order of relevance: the most relevant ones are kept,
+    and an item that does not fit is truncated when nothing else fits.
+    The token count of each fitted section is kept in report.
+    """
+
+    def __init__(self, budget: Optional[PromptBudget] = None,
+                 counter: Optional[TokenCounter] = None) -> None:
+        self.budget = budget or PromptBudget()
+        self.counter = counter or TokenCounter()
+        self.report: Dict[str, int] = {}
+        self.num_tool_infos = 0
+
+    def fit_knowledge(self, knowledge: Dict[str, str]) -> Dict[str, str]:
+        """Keep the most relevant knowledge within the budget."""
+        budget = self.budget.related_knowledge
+        fitted: Dict[str, str] = {}
+        for name, description in knowledge.items():
+            candidate = {**fitted, name: description}
+            if self.counter.count(str(candidate)) <= budget:
+                fitted = candidate
+                continue
+            room = budget - self.counter.count(str({**fitted, name: ""}))
+            if room > 0 and not fitted:
+                fitted[name] = self.counter.truncate(description, room)
+            break
+        self.report["related_knowledge"] = self.counter.count(str(fitted))
+        return fitted
+
+    def fit_past_episodes(self, episodes: List[Episode]) -> List[Episode]:
+        """
+        Keep the most relevant past episodes within the budget,
+        truncating their results.
+        """
+        fitted = self._fit_episodes(
+            episodes, self.budget.related_past_episodes, render=lambda kept: str(kept))
+        self.report["related_past_episodes"] = self.counter.count(str(fitted))
+        return fitted
+
+    def fit_recent_episodes(
+            self, episodes: List[Episode], render: Any) -> List[Episode]:
+        """
+        Keep the recent episodes within the budget, truncating their results.
+        render renders the kept episodes the way the prompt does.
+        """
+        # The latest episodes matter most, so they are fitted first.
+        fitted = list(reversed(self._fit_episodes(
+            list(reversed(episodes)), self.budget.recent_episodes,
+            render=lambda kept: render(list(reversed(kept))))))
+        self.report["recent_episodes"] = self.counter.count(render(fitted))
+        return fitted
+
+    def _fit_episodes(
+            self, episodes: List[Episode], budget: int, render: Any) -> List[Episode]:
+        fitted: List[Episode] = []
+        for i, episode in enumerate(episodes):
+            # The results left get an even share of the room,
+            # so long results are cut first.
+            rest = [e.copy(update={"result": ""}) for e in episodes[i:]]
+            room = (budget - self.counter.count(render(fitted + rest))) // len(rest)
+            if room <= 0:
+                break
+            if self.counter.count(episode.result) > room:
+                episode = episode.copy(
+                    update={"result": self.counter.truncate(episode.result, room)})
+            if self.counter.count(render(fitted + [episode])) > budget:
+                break
+            fitted.append(episode)
+        return fitted
+
+    def fits_tool_info(self, tool_infos: List[str]) -> bool:
+        """Whether every tool info fits within the budget."""
+        tool_info = "".join(info + "\n" for info in tool_infos)
+        return self.counter.count(tool_info) <= self.budget.tool_info
+
+    def fit_tool_info(self, tool_infos: List[str]) -> str:
+        """
+        Keep the most relevant tool infos within the budget.
+        The number of tool infos kept is kept in num_tool_infos.
+        """
+        tool_info = ""
+        self.num_tool_infos = 0
+        for info in tool_infos:
+            if self.counter.count(tool_info + info + "\n") > self.budget.tool_info:
+                break
+            tool_info += info + "\n"
+            self.num_tool_infos += 1
+        self.report["tool_info"] = self.counter.count(tool_info)
+        return tool_info
@@ -1,11 +1,12 @@
 # flake8: noqa
 import json
 import time
+from functools import lru_cache
 from langchain.prompts import PromptTemplate
 from pydantic import Field
 from typing import List
 from memory.episodic_memory import Episode
-from llm.reason.schema import JsonSchema
+from llm.reason.schema import JsonSchema, ParallelJsonSchema
 from langchain.prompts import PromptTemplate
 from langchain.prompts.chat import (
     ChatPromptTemplate,
@@ -21,6 +22,7 @@ from langchain.schema import (
 
 # Convert the schema object to a string
 JSON_SCHEMA_STR = json.dumps(JsonSchema.schema)
+PARALLEL_JSON_SCHEMA_STR = json.dumps(ParallelJsonSchema.schema)
 
 BASE_TEMPLATE = """
 
@@ -78,51 +80,93 @@ Please ensure your output strictly follows JSON RESPONSE FORMAT.
 Determine which next command to use, and respond using the format specified above:
 """.replace("{", "{{").replace("}", "}}")
 
+ONE_TOOL_RULE = "You can ONLY ONE TOOL at a time"
+PARALLEL_TOOLS_RULE = (
+    "You can use SEVERAL TOOLS at a time in 'actions' when the calls do not depend on each other's results. "
+    "They run at the same time. Use task_complete alone")
+PARALLEL_SCHEMA_TEMPLATE = SCHEMA_TEMPLATE.replace(
+    JSON_SCHEMA_STR.replace("{", "{{").replace("}", "}}"),
+    PARALLEL_JSON_SCHEMA_STR.replace("{", "{{").replace("}", "}}"))
 
-def get_template(memory: List[Episode] = None) -> PromptTemplate:
-    template = BASE_TEMPLATE
 
-    # If there are past conversation logs, append them
-    if len(memory) > 0:
-        # insert current time and date
-        recent_episodes = RECENT_EPISODES_TEMPLETE
-        RECENT_EPISODES_TEMPLETE += f"The current time and date is {time.strftime('%c')}"
+def get_recent_episodes(memory: List[Episode] = None) -> str:
+    """Render the recent episodes for the {recent_episodes} variable of the templates."""
+    if not memory:
+        return ""
+
+    # insert current time and date
+    recent_episodes = RECENT_EPISODES_TEMPLETE
+    recent_episodes += f"The current time and date is {time.strftime('%c')}"
+
+    # insert past conversation logs
+    for episode in memory:
+        thoughts_str = json.dumps(episode.thoughts)
+        action_str = json.dumps(episode.action)
+        result = episode.result
+        recent_episodes += thoughts_str + "/n" + action_str + "/n" + result + "/n"
+    return recent_episodes
+
+
+def _base_template(parallel: bool) -> str:
+    if parallel:
+        return BASE_TEMPLATE.replace(ONE_TOOL_RULE, PARALLEL_TOOLS_RULE)
+    return BASE_TEMPLATE
+
+
+def _schema_template(parallel: bool) -> str:
+    return PARALLEL_SCHEMA_TEMPLATE if parallel else SCHEMA_TEMPLATE
+
 
-        # insert past conversation logs
-        for episode in memory:
-            thoughts_str = json.dumps(episode.thoughts)
-            action_str = json.dumps(episode.action)
-            result = episode.result
-            recent_episodes += thoughts_str + "/n" + action_str + "/n" + result + "/n"
+def get_template(memory: List[Episode] = None, parallel: bool = False) -> PromptTemplate:
+    """
+    Get the template for the shape of the memory.
+    The recent episodes are filled in through the {recent_episodes} variable.
+    With parallel, the response holds a list of actions.
+    """
+    return _compile_template(bool(memory), parallel)
 
-        template += recent_episodes
 
-    template += SCHEMA_TEMPLATE
+@lru_cache(maxsize=None)
+def _compile_template(has_recent_episodes: bool, parallel: bool = False) -> PromptTemplate:
+    template = _base_template(parallel)
+    input_variables = ["name", "role", "goal", "related_knowledge", "related_past_episodes", "task", "tool_info"]
+
+    # If there are past conversation logs, append them
+    if has_recent_episodes:
+        template += "{recent_episodes}"
+        input_variables.append("recent_episodes")
+
+    template += _schema_template(parallel)
 
     PROMPT = PromptTemplate(
-        input_variables=["name", "role", "goal", "related_knowledge", "related_past_episodes", "task", "tool_info"], template=template)
+        input_variables=input_variables, template=template)
 
     return PROMPT
 
 
-def get_chat_template(memory: List[Episode] = None) -> ChatPromptTemplate:
+def get_chat_template(memory: List[Episode] = None, parallel: bool = False) -> ChatPromptTemplate:
+    """
+    Get the chat template for the shape of the memory.
+    The recent episodes are filled in through the {recent_episodes} variable.
+    With parallel, the response holds a list of actions.
+    """
+    return _compile_chat_template(bool(memory), parallel)
+
+
+def clear_template_cache() -> None:
+    """Forget the compiled templates, so the next ones are compiled again."""
+    _compile_template.cache_clear()
+    _compile_chat_template.cache_clear()
+
+
+@lru_cache(maxsize=None)
+def _compile_chat_template(has_recent_episodes: bool, parallel: bool = False) -> ChatPromptTemplate:
     messages = []
-    messages.append(SystemMessagePromptTemplate.from_template(BASE_TEMPLATE))
+    messages.append(SystemMessagePromptTemplate.from_template(_base_template(parallel)))
 
     # If there are past conversation logs, append them
-    if len(memory) > 0:
-        # insert current time and date
-        recent_episodes = RECENT_EPISODES_TEMPLETE
-        recent_episodes += f"The current time and date is {time.strftime('%c')}"
-
-        # insert past conversation logs
-        for episode in memory:
-            thoughts_str = json.dumps(episode.thoughts)
-            action_str = json.dumps(episode.action)
-            result = episode.result
-            recent_episodes += thoughts_str + "/n" + action_str + "/n" + result + "/n"
-
-        messages.append(SystemMessage(content=recent_episodes))
-    messages.append(SystemMessage(content=SCHEMA_TEMPLATE))
+    if has_recent_episodes:
+        messages.append(SystemMessagePromptTemplate.from_template("{recent_episodes}"))
+    messages.append(SystemMessagePromptTemplate.from_template(_schema_template(parallel)))
 
     return ChatPromptTemplate.from_messages(messages)
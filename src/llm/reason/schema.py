@@ -18,3 +18,26 @@ class JsonSchema:
             }
         }
     }
+
+
+class ParallelJsonSchema:
+    schema = {
+        "observation": JsonSchema.schema["observation"],
+        "thoughts": JsonSchema.schema["thoughts"],
+        "actions": [
+            {
+                "tool_name": "One of the tool names included in [TOOLS]",
+                "args": {
+                    "arg name": "value",
+                    "arg name": "value"
+                }
+            },
+            {
+                "tool_name": "Another tool name included in [TOOLS], "
+                             "for a call independent of the other actions",
+                "args": {
+                    "arg name": "value"
+                }
+            }
+        ]
+    }
@@ -0,0 +1,233 @@
+import json
+import threading
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
+from langchain.callbacks.base import BaseCallbackHandler
+from langchain.schema import AgentAction, AgentFinish, LLMResult
+
+JsonPath = Tuple[Union[str, int], ...]
+
+# Parser states
+_START = "start"
+_VALUE = "value"
+_KEY = "key"
+_COLON = "colon"
+_AFTER_VALUE = "after_value"
+_STRING = "string"
+_SCALAR = "scalar"
+_DONE = "done"
+_FAILED = "failed"
+
+
+class IncrementalJsonParser:
+    """
+    JSON object parser fed with chunks of text, such as streamed LLM tokens.
+    Each value is reported with its path as soon as it is complete.
+    Text before the first "{" and after the closing "}" is ignored.
+    """
+
+    def __init__(
+            self, on_value: Optional[Callable[[JsonPath, Any], None]] = None) -> None:
+        self.on_value = on_value
+        self.value: Optional[Dict[str, Any]] = None
+        self._state = _START
+        # The open containers with their paths, and the key of the value being parsed.
+        self._stack: List[Tuple[Union[Dict[str, Any], List[Any]], JsonPath]] = []
+        self._key: Optional[str] = None
+        self._buffer = ""
+        self._is_key = False
+        self._escaped = False
+
+    @property
+    def done(self) -> bool:
+        """Whether the root object is closed."""
+        return self._state == _DONE
+
+    @property
+    def failed(self) -> bool:
+        """Whether the text is not valid JSON."""
+        return self._state == _FAILED
+
+    def feed(self, text: str) -> None:
+        """Parse the next chunk of text."""
+        for char in text:
+            if self._state in (_DONE, _FAILED):
+                return
+            self._feed_char(char)
+
+    def _feed_char(self, char: str) -> None:
+        if self._state == _START:
+            if char == "{":
+                self._open({})
+            return
+
+        if self._state == _STRING:
+            if self._escaped:
+                self._escaped = False
+            elif char == "\\":
+                self._escaped = True
+            elif char == '"':
+                try:
+                    value = json.loads(f'"{self._buffer}"', strict=False)
+                except json.JSONDecodeError:
+                    self._state = _FAILED
+                    return
+                if self._is_key:
+                    self._key = value
+                    self._state = _COLON
+                else:
+                    self._complete(value)
+                return
+            self._buffer += char
+            return
+
+        if self._state == _SCALAR:
+            if char not in ",]} \t\r\n":
+                self._buffer += char
+                return
+            try:
+                value = json.loads(self._buffer)
+            except json.JSONDecodeError:
+                self._state = _FAILED
+                return
+            self._complete(value)
+
+        if char in " \t\r\n":
+            return
+
+        if self._state == _VALUE:
+            if char == "{":
+                self._open({})
+            elif char == "[":
+                self._open([])
+            elif char == '"':
+                self._start_string(is_key=False)
+            elif char == "]" and isinstance(self._stack[-1][0], list) \
+                    and not self._stack[-1][0]:
+                self._close()
+            else:
+                self._buffer = char
+                self._state = _SCALAR
+        elif self._state == _KEY:
+            if char == '"':
+                self._start_string(is_key=True)
+            elif char == "}":
+                self._close()
+            else:
+                self._state = _FAILED
+        elif self._state == _COLON:
+            self._state = _VALUE if char == ":" else _FAILED
+        elif self._state == _AFTER_VALUE:
+            container = self._stack[-1][0]
+            if char == ",":
+                self._state = _KEY if isinstance(container, dict) else _VALUE
+            elif char == ("}" if isinstance(container, dict) else "]"):
+                self._close()
+            else:
+                self._state = _FAILED
+
+    def _start_string(self, is_key: bool) -> None:
+        self._buffer = ""
+        self._is_key = is_key
+        self._escaped = False
+        self._state = _STRING
+
+    def _child_path(self) -> JsonPath:
+        """Get the path of the value being parsed."""
+        container, path = self._stack[-1]
+        if isinstance(container, dict):
+            return path + (self._key,)
+        return path + (len(container),)
+
+    def _attach(self, value: Any) -> JsonPath:
+        """Put a value in the innermost container and return its path."""
+        path = self._child_path()
+        container = self._stack[-1][0]
+        if isinstance(container, dict):
+            container[self._key] = value
+        else:
+            container.append(value)
+        return path
+
+    def _open(self, container: Union[Dict[str, Any], List[Any]]) -> None:
+        if self._stack:
+            path = self._attach(container)
+        else:
+            self.value, path = container, ()
+        self._stack.append((container, path))
+        self._state = _KEY if isinstance(container, dict) else _VALUE
+
+    def _complete(self, value: Any) -> None:
+        path = self._attach(value)
+        self._state = _AFTER_VALUE
+        self._emit(path, value)
+
+    def _close(self) -> None:
+        container, path = self._stack.pop()
+        self._state = _AFTER_VALUE if self._stack else _DONE
+        self._emit(path, container)
+
+    def _emit(self, path: JsonPath, value: Any) -> None:
+        if self.on_value is not None:
+            self.on_value(path, value)
+
+
+class StreamingJsonCallbackHandler(BaseCallbackHandler):
+    """
+    Callback handler feeding the tokens streamed by an LLM to an incremental parser.
+    Only the tokens of the calls made from the thread that created the handler
+    are parsed, so other calls sharing the LLM do not interleave.
+    """
+
+    def __init__(self, parser: IncrementalJsonParser) -> None:
+        self.parser = parser
+        self.thread_id = threading.get_ident()
+
+    @property
+    def always_verbose(self) -> bool:
+        return True
+
+    def on_llm_new_token(self, token: str, **kwargs: Any) -> None:
+        if threading.get_ident() == self.thread_id:
+            self.parser.feed(token)
+
+    def on_llm_start(self, serialized: Dict[str, Any], prompts: List[str],
+                     **kwargs: Any) -> None:
+        pass
+
+    def on_llm_end(self, response: LLMResult, **kwargs: Any) -> None:
+        pass
+
+    def on_llm_error(self, error: Union[Exception, KeyboardInterrupt],
+                     **kwargs: Any) -> None:
+        pass
+
+    def on_chain_start(self, serialized: Dict[str, Any], inputs: Dict[str, Any],
+                       **kwargs: Any) -> None:
+        pass
+
+    def on_chain_end(self, outputs: Dict[str, Any], **kwargs: Any) -> None:
+        pass
+
+    def on_chain_error(self, error: Union[Exception, KeyboardInterrupt],
+                       **kwargs: Any) -> None:
+        pass
+
+    def on_tool_start(self, serialized: Dict[str, Any], input_str: str,
+                      **kwargs: Any) -> None:
+        pass
+
+    def on_tool_end(self, output: str, **kwargs: Any) -> None:
+        pass
+
+    def on_tool_error(self, error: Union[Exception, KeyboardInterrupt],
+                      **kwargs: Any) -> None:
+        pass
+
+    def on_text(self, text: str, **kwargs: Any) -> None:
+        pass
+
+    def on_agent_action(self, action: AgentAction, **kwargs: Any) -> None:
+        pass
+
+    def on_agent_finish(self, finish: AgentFinish, **kwargs: Any) -> None:
+        pass
@@ -1,4 +1,4 @@
-
+from functools import lru_cache
 from typing import List
 from langchain.prompts import PromptTemplate
 from langchain.prompts.chat import (
@@ -30,6 +30,7 @@ Using above [THOUGHTS], [ACTION], and [RESULT OF ACTION], please summarize the e
 """
 
 
+@lru_cache(maxsize=None)
 def get_template() -> PromptTemplate:
     template = BASE_TEMPLATE
     prompt_template = PromptTemplate(
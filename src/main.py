@@ -2,6 +2,7 @@ import os
 from dotenv import load_dotenv
 from agent import Agent
 from tools.base import AgentTool
+from tools.cache import ToolCacheConfig
 from ui.cui import CommandlineUserInterface
 from langchain.utilities import GoogleSearchAPIWrapper
 from langchain.llms import OpenAI
@@ -51,7 +52,9 @@ search_tool = AgentTool(
     description="""
         "With this tool, you can search the web using Google search engine"
         "It is a great way to quickly find information on the web.""",
-    user_permission_required=False
+    user_permission_required=False,
+    # Results are cached for a day under the agent directory.
+    cache=ToolCacheConfig()
 )
 
 ### 3. Momoize usage of tools to agent ###
@@ -0,0 +1,172 @@
+import hashlib
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+import numpy as np
+from langchain.embeddings.base import Embeddings
+
+DEFAULT_MODEL_NAME = "sentence-transformers/all-mpnet-base-v2"
+DEFAULT_CACHE_SIZE = 4096
+
+_shared_embeddings: Dict[str, "SharedEmbeddings"] = {}
+_shared_embeddings_lock = threading.Lock()
+
+
+class SharedEmbeddings(Embeddings):
+    """
+    Lazily loaded sentence-transformers embeddings.
+    The model is built on the first embed call and then reused.
+    """
+
+    def __init__(self, model_name: str = DEFAULT_MODEL_NAME) -> None:
+        self.model_name = model_name
+        self._client = None
+        self._lock = threading.Lock()
+
+    @property
+    def is_loaded(self) -> bool:
+        """Whether the underlying model has been loaded."""
+        return self._client is not None
+
+    @property
+    def client(self) -> Any:
+        """Get the underlying model, loading it if necessary."""
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    self._client = self._load_client()
+        return self._client
+
+    def _load_client(self) -> Any:
+        """Load the sentence-transformers model."""
+        try:
+            import sentence_transformers
+        except ImportError:
+            raise ValueError(
+                "Could not import sentence_transformers python package. "
+                "Please install it with `pip install sentence_transformers`."
+            )
+        return sentence_transformers.SentenceTransformer(self.model_name)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        """Embed a list of texts."""
+        texts = [text.replace("\n", " ") for text in texts]
+        return self.client.encode(texts).tolist()
+
+    def embed_query(self, text: str) -> List[float]:
+        """Embed a query text."""
+        return self.embed_documents([text])[0]
+
+    def __copy__(self) -> "SharedEmbeddings":
+        # pydantic copies field defaults, but the model must stay shared.
+        return self
+
+    def __deepcopy__(self, memo: Dict[int, Any]) -> "SharedEmbeddings":
+        return self
+
+
+def get_shared_embeddings(model_name: str = DEFAULT_MODEL_NAME) -> SharedEmbeddings:
+    """Get the process-wide embeddings for a model name."""
+    with _shared_embeddings_lock:
+        if model_name not in _shared_embeddings:
+            _shared_embeddings[model_name] = SharedEmbeddings(model_name=model_name)
+        return _shared_embeddings[model_name]
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Content-addressed cache in front of another embeddings.
+    Vectors are kept in an in-memory LRU and, if a path is given, in SQLite.
+    """
+
+    def __init__(self,
+                 embeddings: Embeddings,
+                 path: Optional[str] = None,
+                 max_size: int = DEFAULT_CACHE_SIZE) -> None:
+        self.embeddings = embeddings
+        self.model_name = getattr(embeddings, "model_name", type(embeddings).__name__)
+        self.path = path
+        self.max_size = max_size
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._lru: OrderedDict[str, List[float]] = OrderedDict()
+        self._lock = threading.Lock()
+        self._conn = None
+        if path is not None:
+            self._conn = sqlite3.connect(path, check_same_thread=False)
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings "
+                "(key TEXT PRIMARY KEY, vector BLOB)")
+            self._conn.commit()
+
+    def _key(self, text: str) -> str:
+        """Get the cache key of a text."""
+        return hashlib.sha256(f"{self.model_name}\0{text}".encode("utf-8")).hexdigest()
+
+    def _lookup(self, key: str) -> Optional[List[float]]:
+        """Look up a vector in the memory tier and then in the disk tier."""
+        if key in self._lru:
+            self._lru.move_to_end(key)
+            self.hits += 1
+            return self._lru[key]
+        if self._conn is not None:
+            row = self._conn.execute(
+                "SELECT vector FROM embeddings WHERE key = ?", (key,)).fetchone()
+            if row is not None:
+                vector = np.frombuffer(row[0], dtype=np.float32).tolist()
+                self._remember(key, vector)
+                self.disk_hits += 1
+                return vector
+        return None
+
+    def _remember(self, key: str, vector: List[float]) -> None:
+        """Put a vector in the memory tier."""
+        self._lru[key] = vector
+        self._lru.move_to_end(key)
+        while len(self._lru) > self.max_size:
+            self._lru.popitem(last=False)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        """Embed a list of texts, computing only the ones not cached yet."""
+        keys = [self._key(text) for text in texts]
+        vectors: List[Optional[List[float]]] = [None] * len(texts)
+        missing: Dict[str, List[int]] = {}
+        with self._lock:
+            for i, key in enumerate(keys):
+                vectors[i] = self._lookup(key)
+                if vectors[i] is None:
+                    missing.setdefault(key, []).append(i)
+
+        if missing:
+            positions = list(missing.values())
+            new_vectors = self.embeddings.embed_documents(
+                [texts[indexes[0]] for indexes in positions])
+            with self._lock:
+                self.misses += len(positions)
+                for key, indexes, vector in zip(missing, positions, new_vectors):
+                    self._remember(key, vector)
+                    for i in indexes:
+                        vectors[i] = vector
+                if self._conn is not None:
+                    self._conn.executemany(
+                        "INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)",
+                        [(key, np.asarray(vector, dtype=np.float32).tobytes())
+                         for key, vector in zip(missing, new_vectors)])
+                    self._conn.commit()
+        return vectors
+
+    def embed_query(self, text: str) -> List[float]:
+        """Embed a query text."""
+        return self.embed_documents([text])[0]
+
+    def stats(self) -> Dict[str, int]:
+        """Get the hit and miss counters of the cache."""
+        return {"hits": self.hits, "disk_hits": self.disk_hits, "misses": self.misses}
+
+    def __copy__(self) -> "CachedEmbeddings":
+        return self
+
+    def __deepcopy__(self, memo: Dict[int, Any]) -> "CachedEmbeddings":
+        return self
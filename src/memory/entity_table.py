@@ -0,0 +1,153 @@
+import re
+from typing import Any, Dict, List, Optional, Tuple
+from pydantic import BaseModel, Field
+from memory.sqlite_store import SqliteStore
+
+ENTITY_TABLE_FILENAME = "entities.sqlite3"
+MAX_DESCRIPTION_LENGTH = 1000
+
+
+class Entity(BaseModel):
+    id: int = Field(..., description="The id of the entity in the vector index")
+    name: str = Field(..., description="The name of the entity")
+    description: str = Field(..., description="The description of the entity")
+    version: int = Field(
+        1, description="The number of times the description was written")
+
+
+def normalize_entity_name(name: str) -> str:
+    """Normalize an entity name so spelling variants share one key."""
+    name = re.sub(r"\s+", " ", str(name)).strip().strip("\"'`.,;:").strip()
+    return name.casefold()
+
+
+def merge_descriptions(old: str, new: str) -> str:
+    """Merge a new description of an entity into the old one."""
+    if new.strip() in old:
+        return old
+    if old.strip() in new:
+        return new
+    merged = f"{old.rstrip()} {new.strip()}"
+    if len(merged) > MAX_DESCRIPTION_LENGTH:
+        # Prefer the latest knowledge when the description grows too long.
+        return new
+    return merged
+
+
+def _to_entity(row: Tuple[Any, ...]) -> Entity:
+    """Make an entity from an (id, name, description, version) row."""
+    return Entity(id=row[0], name=row[1], description=row[2], version=row[3])
+
+
+class EntityTable(SqliteStore):
+    """
+    Entities keyed by their normalized name.
+    Each row counts the versions of its description and the version whose
+    vector was last saved, so the descriptions written after the vector index
+    was saved can be embedded again on load.
+    """
+    schema = """
+        CREATE TABLE IF NOT EXISTS entities (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            key TEXT UNIQUE NOT NULL,
+            name TEXT NOT NULL,
+            description TEXT NOT NULL,
+            version INTEGER NOT NULL DEFAULT 1,
+            saved_version INTEGER NOT NULL DEFAULT 0
+        );
+    """
+
+    def __init__(self, path: Optional[str] = None) -> None:
+        super().__init__(path)
+        with self.lock:
+            columns = [
+                row[1] for row in self.conn.execute("PRAGMA table_info(entities)")]
+            if "version" not in columns:
+                # Tables saved before versions were counted are taken as saved.
+                self.conn.execute(
+                    "ALTER TABLE entities "
+                    "ADD COLUMN version INTEGER NOT NULL DEFAULT 1")
+                self.conn.execute(
+                    "ALTER TABLE entities "
+                    "ADD COLUMN saved_version INTEGER NOT NULL DEFAULT 1")
+                self.conn.commit()
+
+    def __len__(self) -> int:
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM entities").fetchone()[0]
+
+    def get(self, name: str) -> Optional[Entity]:
+        """Get an entity by name."""
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT id, name, description, version FROM entities WHERE key = ?",
+                (normalize_entity_name(name),)).fetchone()
+        return None if row is None else _to_entity(row)
+
+    def get_by_ids(self, ids: List[int]) -> Dict[int, Entity]:
+        """Get entities by their ids."""
+        if not ids:
+            return {}
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT id, name, description, version FROM entities WHERE id IN "
+                f"({','.join('?' * len(ids))})", ids).fetchall()
+        return {row[0]: _to_entity(row) for row in rows}
+
+    def after(self, entity_id: int) -> List[Entity]:
+        """Get the entities inserted after an id."""
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT id, name, description, version FROM entities "
+                "WHERE id > ? ORDER BY id",
+                (entity_id,)).fetchall()
+        return [_to_entity(row) for row in rows]
+
+    def unsaved(self) -> List[Entity]:
+        """Get the entities whose latest description has no saved vector."""
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT id, name, description, version FROM entities "
+                "WHERE saved_version < version ORDER BY id").fetchall()
+        return [_to_entity(row) for row in rows]
+
+    def mark_saved(self, versions: Dict[int, int]) -> None:
+        """Record the saved vector versions of the descriptions, by entity id."""
+        if not versions:
+            return
+        with self.lock:
+            self.conn.executemany(
+                "UPDATE entities SET saved_version = MAX(saved_version, ?) "
+                "WHERE id = ?",
+                [(version, entity_id) for entity_id, version in versions.items()])
+            self.conn.commit()
+
+    def upsert(self, name: str, description: str) -> Optional[Entity]:
+        """
+        Insert an entity or merge the description into the existing one.
+        Returns the entity if its description changed, otherwise None.
+        """
+        key = normalize_entity_name(name)
+        if not key:
+            return None
+        with self.lock:
+            entity = self.get(name)
+            if entity is None:
+                cursor = self.conn.execute(
+                    "INSERT INTO entities (key, name, description) VALUES (?, ?, ?)",
+                    (key, name, description))
+                entity = Entity(id=cursor.lastrowid, name=name, description=description)
+            else:
+                merged = merge_descriptions(entity.description, description)
+                if merged == entity.description:
+                    return None
+                entity = Entity(
+                    id=entity.id, name=name, description=merged,
+                    version=entity.version + 1)
+                self.conn.execute(
+                    "UPDATE entities SET name = ?, description = ?, version = ? "
+                    "WHERE id = ?",
+
+                    (name, merged, entity.version, entity.id))
+            self.conn.commit()
+        return entity
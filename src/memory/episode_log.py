@@ -0,0 +1,149 @@
+import json
+from typing import Any, Dict, List, Optional, Tuple
+from memory.sqlite_store import SqliteStore
+
+EPISODE_LOG_FILENAME = "episodes.sqlite3"
+
+
+class EpisodeLog(SqliteStore):
+    """
+    Log of episode payloads indexed by episode id.
+    Episodes are appended, and old ones are only replaced by their consolidation.
+    Each row records whether the vector of its payload was saved, so the
+    payloads written after the vector index was saved can be embedded again.
+    """
+    schema = """
+        CREATE TABLE IF NOT EXISTS episodes (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            payload TEXT NOT NULL,
+            saved INTEGER NOT NULL DEFAULT 0
+        );
+    """
+
+    def __init__(self, path: Optional[str] = None) -> None:
+        super().__init__(path)
+        with self.lock:
+            columns = [
+                row[1] for row in self.conn.execute("PRAGMA table_info(episodes)")]
+            if "saved" not in columns:
+                # Logs saved before the column was added are taken as saved.
+                self.conn.execute(
+                    "ALTER TABLE episodes ADD COLUMN saved INTEGER NOT NULL DEFAULT 1")
+                self.conn.commit()
+
+    def __len__(self) -> int:
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM episodes").fetchone()[0]
+
+    def append(self, payload: Dict[str, Any]) -> int:
+        """Append an episode payload and return its id."""
+        with self.lock:
+            cursor = self.conn.execute(
+                "INSERT INTO episodes (payload) VALUES (?)", (json.dumps(payload),))
+            self.conn.commit()
+        return cursor.lastrowid
+
+    def size(self) -> int:
+        """Get the total size of the payloads in bytes."""
+        with self.lock:
+            return self.conn.execute(
+                "SELECT COALESCE(SUM(LENGTH(CAST(payload AS BLOB))), 0) "
+                "FROM episodes").fetchone()[0]
+
+    def get_many(self, ids: List[int]) -> Dict[int, Dict[str, Any]]:
+        """Get the payloads of the ids."""
+        if not ids:
+            return {}
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT id, payload FROM episodes WHERE id IN "
+                f"({','.join('?' * len(ids))})", ids).fetchall()
+        return {row[0]: json.loads(row[1]) for row in rows}
+
+    def recent(self, n: int) -> List[Tuple[int, Dict[str, Any]]]:
+        """Get the ids and payloads of the last n episodes, oldest first."""
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT id, payload FROM episodes ORDER BY id DESC LIMIT ?",
+                (n,)).fetchall()
+        return [(row[0], json.loads(row[1])) for row in reversed(rows)]
+
+    def ids(self) -> List[int]:
+        """Get the ids of every episode."""
+        with self.lock:
+            return [row[0] for row in self.conn.execute("SELECT id FROM episodes")]
+
+    def unsaved(self) -> List[Tuple[int, Dict[str, Any]]]:
+        """Get the episodes without a saved vector, oldest first, with their ids."""
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT id, payload FROM episodes WHERE saved = 0 "
+                "ORDER BY id").fetchall()
+        return [(row[0], json.loads(row[1])) for row in rows]
+
+    def mark_saved(self, ids: List[int]) -> None:
+        """Record that the vectors of the episodes of the ids were saved."""
+        if not ids:
+            return
+        with self.lock:
+            self.conn.executemany(
+                "UPDATE episodes SET saved = 1 WHERE id = ?", [(i,) for i in ids])
+            self.conn.commit()
+
+    def after(self, episode_id: int) -> List[Tuple[int, Dict[str, Any]]]:
+        """Get the ids and payloads of the episodes after an id, oldest first."""
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT id, payload FROM episodes WHERE id > ? ORDER BY id",
+                (episode_id,)).fetchall()
+        return [(row[0], json.loads(row[1])) for row in rows]
+
+    def all(self) -> List[Tuple[int, Dict[str, Any]]]:
+        """Get the ids and payloads of every episode, oldest first."""
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT id, payload FROM episodes ORDER BY id").fetchall()
+        return [(row[0], json.loads(row[1])) for row in rows]
+
+    def oldest_peers(self, n: int, keep: int = 0, before: Optional[float] = None
+                     ) -> List[Tuple[int, Dict[str, Any]]]:
+        """
+        Get the ids and payloads of the first n episodes of the lowest consolidation
+        level with n episodes, leaving out the last keep episodes and, with before,
+        the episodes created from then on.
+        Returns nothing when no level has n episodes.
+        """
+        conditions = "id NOT IN (SELECT id FROM episodes ORDER BY id DESC LIMIT ?)"
+        params: List[Any] = [keep]
+        if before is not None:
+            conditions += " AND json_extract(payload, '$.created_at') < ?"
+            params.append(before)
+        level = "COALESCE(json_extract(payload, '$.level'), 0)"
+        with self.lock:
+            row = self.conn.execute(
+                f"SELECT {level} AS level FROM episodes WHERE {conditions} "
+                "GROUP BY level HAVING COUNT(*) >= ? ORDER BY level LIMIT 1",
+                params + [n]).fetchone()
+            if row is None:
+                return []
+            rows = self.conn.execute(
+                f"SELECT id, payload FROM episodes WHERE {conditions} "
+                f"AND {level} = ? ORDER BY id LIMIT ?",
+                params + [row[0], n]).fetchall()
+        return [(row[0], json.loads(row[1])) for row in rows]
+
+    def replace(self, ids: List[int], payload: Dict[str, Any]) -> int:
+        """
+        Replace the episodes of the ids with one payload and return its id.
+        The payload takes the smallest id, so it keeps the place of the episodes
+        in the log, and it is marked unsaved until its vector is saved.
+        """
+        episode_id = min(ids)
+        with self.lock:
+            self.conn.execute(
+                f"DELETE FROM episodes WHERE id IN ({','.join('?' * len(ids))})", ids)
+            self.conn.execute(
+                "INSERT INTO episodes (id, payload) VALUES (?, ?)",
+                (episode_id, json.dumps(payload)))
+            self.conn.commit()
+        return episode_id
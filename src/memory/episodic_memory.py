@@ -1,10 +1,32 @@
-from typing import List, Dict, Any
-from pydantic import BaseModel, Field
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Any, Optional, Set, Tuple
+from pydantic import BaseModel, Field, PrivateAttr
 from langchain.llms.base import BaseLLM
 from langchain import LLMChain
-from langchain.vectorstores import VectorStore, FAISS
-from langchain.embeddings import HuggingFaceEmbeddings
+from langchain.vectorstores import FAISS
+from langchain.embeddings.base import Embeddings
+from memory.embeddings import get_shared_embeddings
+from memory.write_buffer import (
+    EmbeddingWriteBuffer,
+    DEFAULT_MAX_BATCH_SIZE,
+    DEFAULT_MAX_DELAY
+)
+from memory.vector_index import (
+    VectorIndex,
+    DEFAULT_ANN_NPROBE,
+    DEFAULT_ANN_THRESHOLD,
+    DEFAULT_COMPACT_AFTER
+)
+from memory.episode_log import EpisodeLog, EPISODE_LOG_FILENAME
 from llm.summarize.prompt import get_template
+import llm.consolidate.prompt as ConsolidatePrompt
+
+DEFAULT_RETENTION_MAX_EPISODES = 1000
+DEFAULT_CONSOLIDATION_BATCH_SIZE = 10
+DEFAULT_RETENTION_KEEP_RECENT = 10
+DEFAULT_MAX_CHUNK_WORKERS = 4
 
 
 class Episode(BaseModel):
@@ -12,29 +34,106 @@ class Episode(BaseModel):
     action: Dict[str, Any] = Field(..., description="action of the agent")
     result: str = Field(..., description="The plan of the event")
     summary: str = Field("", description="summary of the event")
+    # The bookkeeping fields are left out of the repr the prompts are rendered with.
+    created_at: float = Field(
+        default_factory=time.time, description="The unix time of the event", repr=False)
+    level: int = Field(
+        0,
+        description="0 for a raw episode, otherwise the depth of its consolidation",
+        repr=False)
+    num_consolidated: int = Field(
+        1, description="The number of raw episodes the episode covers", repr=False)
+    full_result: Optional[str] = Field(
+        None,
+        description="The whole result of the action when result is an excerpt of it",
+        repr=False)
 
 
 class EpisodicMemory(BaseModel):
     num_episodes: int = Field(0, description="The number of episodes")
-    store: Dict[str, Episode] = Field({}, description="The list of episodes")
+    log: EpisodeLog = Field(
+        default_factory=EpisodeLog, description="The log of the episode payloads")
     llm: BaseLLM = Field(..., description="llm class for the agent")
-    embeddings: HuggingFaceEmbeddings = Field(
-        HuggingFaceEmbeddings(), title="Embeddings to use for tool retrieval")
-    vector_store: VectorStore = Field(
-        None, title="Vector store to use for tool retrieval")
+    embeddings: Embeddings = Field(
+        default_factory=get_shared_embeddings,
+        title="Embeddings to use for tool retrieval")
+    vector_index: VectorIndex = Field(
+        default_factory=VectorIndex, title="Vector index of the episode summaries")
+    write_batch_size: int = Field(
+        DEFAULT_MAX_BATCH_SIZE,
+        description="The number of episodes embedded in one batch")
+    write_max_delay: float = Field(
+        DEFAULT_MAX_DELAY, description="The seconds an episode may wait to be embedded")
+    retention_max_episodes: Optional[int] = Field(
+        DEFAULT_RETENTION_MAX_EPISODES,
+        description="The number of episodes kept before old ones are consolidated")
+    retention_max_age: Optional[float] = Field(
+        None, description="The seconds an episode is kept before it is consolidated")
+    retention_max_bytes: Optional[int] = Field(
+        None,
+        description="The size of the episode log in bytes before old episodes are "
+                    "consolidated")
+    retention_keep_recent: int = Field(
+        DEFAULT_RETENTION_KEEP_RECENT,
+        description="The number of recent episodes never consolidated")
+    consolidation_batch_size: int = Field(
+        DEFAULT_CONSOLIDATION_BATCH_SIZE,
+        description="The number of episodes merged into one")
+    index_compact_after: int = Field(
+        DEFAULT_COMPACT_AFTER,
+        description="The logged vectors after which the saved vector index is "
+                    "rewritten")
+    ann_threshold: Optional[int] = Field(
+        DEFAULT_ANN_THRESHOLD,
+        description="The vectors from which an IVF index is built, "
+                    "or None to stay flat")
+    ann_nprobe: int = Field(
+        DEFAULT_ANN_NPROBE, description="The IVF lists searched for each query")
+    _write_buffer: EmbeddingWriteBuffer = PrivateAttr()
+    # The ids whose vectors were added to the vector index since it was last saved
+    _embedded_ids: Set[int] = PrivateAttr(default_factory=set)
 
     class Config:
         arbitrary_types_allowed = True
 
+    def __init__(self, **data: Any) -> None:
+        super().__init__(**data)
+        if "vector_index" not in data:
+            self.vector_index = VectorIndex(**self._index_settings())
+        self._write_buffer = EmbeddingWriteBuffer(
+            embeddings=self.embeddings,
+            sink=self._add_embeddings,
+            max_batch_size=self.write_batch_size,
+            max_delay=self.write_max_delay)
+
     def memorize_episode(self, episode: Episode) -> None:
         """Memorize an episode."""
+        episode_id = self.log.append(episode.dict())
         self.num_episodes += 1
-        self.store[str(self.num_episodes)] = episode
-        self._embed_episode(episode)
+        self._embed_episode(episode_id, episode)
+        self.consolidate()
 
-    def summarize_and_memorize_episode(self, episode: Episode) -> str:
-        """Summarize and memorize an episode."""
-        summary = self._summarize(episode.thoughts, episode.action, episode.result)
+    def summarize_and_memorize_episode(
+            self, episode: Episode, chunks: Optional[List[str]] = None,
+            max_workers: int = DEFAULT_MAX_CHUNK_WORKERS) -> str:
+        """
+        Summarize and memorize an episode.
+        A large result split into chunks is map-reduced: the chunks are summarized
+        in parallel, and the episode is summarized from the chunk summaries.
+        """
+        if chunks and len(chunks) > 1:
+            with ThreadPoolExecutor(
+                    max_workers=max_workers,
+                    thread_name_prefix="summarize-chunk") as executor:
+                chunk_summaries = list(executor.map(
+                    lambda chunk: self._summarize(
+                        episode.thoughts, episode.action, chunk),
+                    chunks))
+            result = "\n".join(
+                f"- {chunk_summary}" for chunk_summary in chunk_summaries)
+        else:
+            result = episode.result
+        summary = self._summarize(episode.thoughts, episode.action, result)
         episode.summary = summary
         self.memorize_episode(episode)
         return summary
@@ -53,58 +152,169 @@ class EpisodicMemory(BaseModel):
             raise Exception(f"Error: {e}")
         return result
 
+    def consolidate(self) -> int:
+        """
+        Merge the oldest episodes into summaries while the retention policy is exceeded.
+        Only episodes of the same level are merged, in consolidation_batch_size batches,
+        so summaries are merged with their peers into higher-level summaries.
+        The merged episodes are evicted from the log and the vector index.
+        Returns the number of consolidations.
+        """
+        count = 0
+        while True:
+            episodes = self._select_for_consolidation()
+            if len(episodes) < 2:
+                return count
+            self._consolidate(episodes)
+            count += 1
+
+    def _select_for_consolidation(self) -> List[Tuple[int, Episode]]:
+        """
+        Select the oldest batch of peer episodes to consolidate next,
+        if the retention policy is exceeded.
+        """
+        before = None
+        over_episodes = self.retention_max_episodes is not None \
+            and len(self.log) > self.retention_max_episodes
+        over_bytes = self.retention_max_bytes is not None \
+            and self.log.size() > self.retention_max_bytes
+        if not over_episodes and not over_bytes:
+            if self.retention_max_age is None:
+                return []
+            before = time.time() - self.retention_max_age
+        peers = self.log.oldest_peers(
+            self.consolidation_batch_size, keep=self.retention_keep_recent,
+            before=before)
+        return [(episode_id, Episode(**payload)) for episode_id, payload in peers]
+
+    def _consolidate(self, episodes: List[Tuple[int, Episode]]) -> None:
+        """Replace episodes with one episode summarizing them."""
+        summaries = "\n".join(f"- {episode.summary}" for _, episode in episodes)
+        prompt = ConsolidatePrompt.get_template()
+        llm_chain = LLMChain(prompt=prompt, llm=self.llm)
+        try:
+            summary = llm_chain.predict(summaries=summaries)
+        except Exception as e:
+            raise Exception(f"Error: {e}")
+        consolidated = Episode(
+            thoughts={},
+            action={},
+            result=summaries,
+            summary=summary,
+            created_at=max(episode.created_at for _, episode in episodes),
+            level=max(episode.level for _, episode in episodes) + 1,
+            num_consolidated=sum(episode.num_consolidated for _, episode in episodes)
+        )
+        ids = [episode_id for episode_id, _ in episodes]
+        with self._write_buffer.lock:
+            # The queued vectors of the episodes must reach the index
+            # before they are removed.
+            self._write_buffer.flush()
+            self.vector_index.remove(ids)
+            episode_id = self.log.replace(ids, consolidated.dict())
+            self._embed_episode(episode_id, consolidated)
+        self.num_episodes = len(self.log)
+
     def remember_all_episode(self) -> List[Episode]:
         """Remember all episodes."""
-        return self.store
+        return [Episode(**payload) for _, payload in self.log.all()]
 
     def remember_recent_episodes(self, n: int = 5) -> List[Episode]:
         """Remember recent episodes."""
-        if not self.store:  # if empty
-            return self.store
-        n = min(n, len(self.store))
-        return list(self.store.values())[-n:]
+        return [Episode(**payload) for _, payload in self.log.recent(n)]
 
-    def remember_last_episode(self) -> Episode:
+    def remember_last_episode(self) -> Optional[Episode]:
         """Remember last episode."""
-        if not self.store:
-            return None
-        return self.store[-1]
+        episodes = self.remember_recent_episodes(1)
+        return episodes[0] if episodes else None
 
     def remember_related_episodes(self, query: str, k: int = 5) -> List[Episode]:
         """Remember related episodes to a query."""
-        if self.vector_store is None:
+        if not len(self.vector_index) and not len(self._write_buffer):
             return []
-        relevant_documents = self.vector_store.similarity_search(query, k=k)
-        result = []
-        for d in relevant_documents:
-            episode = Episode(
-                thoughts=d.metadata["thoughts"],
-                action=d.metadata["action"],
-                result=d.metadata["result"],
-                summary=d.metadata["summary"]
-            )
-            result.append(episode)
-        return result
+        return self.remember_related_episodes_by_vector(
+            self.embeddings.embed_query(query), k=k)
+
+    def remember_related_episodes_by_vector(
+            self, embedding: List[float], k: int = 5) -> List[Episode]:
+        """Remember related episodes to an embedded query."""
+        with self._write_buffer.lock:
+            self._write_buffer.flush()
+            ids = [i for i, _ in self.vector_index.search(embedding, k=k)]
+        # The index only carries ids, the episodes are loaded from the log.
+        payloads = self.log.get_many(ids)
+        return [Episode(**payloads[i]) for i in ids if i in payloads]
 
-    def _embed_episode(self, episode: Episode) -> None:
-        """Embed an episode and add it to the vector store."""
+    def _embed_episode(self, episode_id: int, episode: Episode) -> None:
+        """Queue an episode to be embedded and added to the vector index."""
         texts = [episode.summary]
-        metadatas = [{"index": self.num_episodes,
-                      "thoughts": episode.thoughts,
-                      "action": episode.action,
-                      "result": episode.result,
-                      "summary": episode.summary}]
-        if self.vector_store is None:
-            self.vector_store = FAISS.from_texts(
-                texts=texts, embedding=self.embeddings, metadatas=metadatas)
-        else:
-            self.vector_store.add_texts(texts=texts, metadatas=metadatas)
+        metadatas = [{"id": episode_id}]
+        self._write_buffer.add(texts=texts, metadatas=metadatas)
+
+    def _add_embeddings(self, texts: List[str], embeddings: List[List[float]],
+                        metadatas: List[Dict[str, Any]]) -> None:
+        """
+        Add embedded episodes to the vector index, replacing the vectors of their ids.
+        """
+        ids = [m["id"] for m in metadatas]
+        self.vector_index.replace(ids, embeddings)
+        self._embedded_ids.update(ids)
+
+    def _index_settings(self) -> Dict[str, Any]:
+        """Get the settings the vector index is created and loaded with."""
+        return {
+            "compact_after": self.index_compact_after,
+            "ann_threshold": self.ann_threshold,
+            "ann_nprobe": self.ann_nprobe,
+        }
+
+    def flush(self) -> None:
+        """Embed the queued episodes now."""
+        self._write_buffer.flush()
 
     def save_local(self, path: str) -> None:
-        """Save the vector store locally."""
-        self.vector_store.save_local(folder_path=path)
+        """Save the vector index and the episode log locally."""
+        with self._write_buffer.lock:
+            self._write_buffer.flush()
+            self.vector_index.save_local(path)
+            self.log.attach(os.path.join(path, EPISODE_LOG_FILENAME))
+            self.log.mark_saved(sorted(self._embedded_ids))
+            self._embedded_ids = set()
+
+    def load_local(self, path: str, mmap: bool = False) -> None:
+        """
+        Load the vector index and the episode log locally,
+        memory-mapping the index if mmap is set.
+        """
+        log_path = os.path.join(path, EPISODE_LOG_FILENAME)
+        legacy_path = os.path.join(path, "index.pkl")
+        if not os.path.exists(log_path) and os.path.exists(legacy_path):
+            self._load_legacy(path)
+            return
+        self.vector_index = VectorIndex.load_local(
+            path, mmap=mmap, **self._index_settings())
+        self.log = EpisodeLog(log_path)
+        self.num_episodes = len(self.log)
+
+        # The index is reconciled with the log: episodes evicted after the index was
+        # last saved are dropped, and episodes written since are embedded again.
+        index_ids = self.vector_index.ids()
+        log_ids = set(self.log.ids())
+        self.vector_index.remove([i for i in index_ids if i not in log_ids])
+        episodes = dict(self.log.unsaved())
+        episodes.update(self.log.after(max(index_ids, default=0)))
+        for episode_id in sorted(episodes):
+            self._embed_episode(episode_id, Episode(**episodes[episode_id]))
 
-    def load_local(self, path: str) -> None:
-        """Load the vector store locally."""
-        self.vector_store = FAISS.load_local(
-            folder_path=path, embeddings=self.embeddings)
+    def _load_legacy(self, path: str) -> None:
+        """Memorize the episodes saved by the former LangChain FAISS vector store."""
+        vector_store = FAISS.load_local(folder_path=path, embeddings=self.embeddings)
+        for i in sorted(vector_store.index_to_docstore_id):
+            doc = vector_store.docstore.search(vector_store.index_to_docstore_id[i])
+            self.memorize_episode(Episode(
+                thoughts=doc.metadata["thoughts"],
+                action=doc.metadata["action"],
+                result=doc.metadata["result"],
+                summary=doc.metadata["summary"]
+            ))
+        self.flush()
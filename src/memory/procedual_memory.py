@@ -1,13 +1,10 @@
-from pydantic import BaseModel, Field
-from langchain.vectorstores import FAISS
-from langchain.vectorstores import VectorStore
-from langchain.schema import Document
-from pydantic import BaseModel, Field
-from langchain.vectorstores import VectorStore, FAISS
-from langchain.schema import Document
-from langchain.embeddings import HuggingFaceEmbeddings
-from typing import List
+from pydantic import BaseModel, Field, PrivateAttr
+from langchain.embeddings.base import Embeddings
+from memory.embeddings import get_shared_embeddings
+from memory.vector_index import VectorIndex
+from typing import Any, Dict, List, Optional
 from tools.base import AgentTool
+from tools.cache import ToolResultCache
 
 
 class ProcedualMemoryException(Exception):
@@ -18,46 +15,109 @@ class ToolNotFoundException(ProcedualMemoryException):
     pass
 
 
+def normalize_tool_name(name: str) -> str:
+    """Normalize a tool name, so the names the LLM writes match the registered ones."""
+    return str(name).strip().strip("\"'`").strip().casefold()
+
+
 class ProcedualMemory(BaseModel):
     tools: List[AgentTool] = Field([], title="hoge")
-    embeddings: HuggingFaceEmbeddings = Field(
-        HuggingFaceEmbeddings(), title="Embeddings to use for tool retrieval")
-    docs: List[Document] = Field([], title="Documents to use for tool retrieval")
-    vector_store: VectorStore = Field(
-        None, title="Vector store to use for tool retrieval")
+    embeddings: Embeddings = Field(
+        default_factory=get_shared_embeddings,
+        title="Embeddings to use for tool retrieval")
+    vector_index: VectorIndex = Field(
+        default_factory=VectorIndex, title="Vector index of the tool descriptions")
+    result_cache: Optional[ToolResultCache] = Field(
+        None,
+        title="Store of the cached tool results, given to the cached tools without "
+              "one")
+    # Tools and their vector ids keyed by their normalized name
+    _tools_by_name: Dict[str, AgentTool] = PrivateAttr(default_factory=dict)
+    _tool_ids: Dict[str, int] = PrivateAttr(default_factory=dict)
+    _tools_by_id: Dict[int, AgentTool] = PrivateAttr(default_factory=dict)
+    _next_id: int = PrivateAttr(1)
 
     class Config:
         arbitrary_types_allowed = True
 
+    def __init__(self, **data: Any) -> None:
+        tools = data.pop("tools", [])
+        super().__init__(**data)
+        self.memorize_tools(tools)
+
     def memorize_tools(self, tools: List[AgentTool]) -> None:
-        """Memorize tools and embed them."""
+        """
+        Memorize tools and embed them.
+        A tool with the name of a memorized tool replaces it, and only
+        new or changed descriptions are embedded. Cached tools without a
+        store of results share the result cache of the memory.
+        """
+        changed: Dict[int, AgentTool] = {}
         for tool in tools:
-            self.tools.append(tool)
-            self.docs = [Document(page_content=t.description, metadata={
-                                  "index": i}) for i, t in enumerate(self.tools)]
-        self._embed_docs()
+            if tool.cache is not None and tool.result_cache is None:
+                tool.result_cache = self.result_cache
+            key = normalize_tool_name(tool.name)
+            old_tool = self._tools_by_name.get(key)
+            if old_tool is None:
+                tool_id = self._next_id
+                self._next_id += 1
+                self._tool_ids[key] = tool_id
+                self.tools.append(tool)
+            else:
+                tool_id = self._tool_ids[key]
+                self.tools[self.tools.index(old_tool)] = tool
+            self._tools_by_name[key] = tool
+            self._tools_by_id[tool_id] = tool
+            if old_tool is None or old_tool.description != tool.description \
+                    or tool_id in changed:
+                changed[tool_id] = tool
+        self._embed_tools(changed)
+
+    def forget_tools(self, tool_names: List[str]) -> None:
+        """Forget tools by name, ignoring unknown names."""
+        ids = []
+        for name in tool_names:
+            key = normalize_tool_name(name)
+            tool = self._tools_by_name.pop(key, None)
+            if tool is None:
+                continue
+            tool_id = self._tool_ids.pop(key)
+            del self._tools_by_id[tool_id]
+            self.tools.remove(tool)
+            ids.append(tool_id)
+        self.vector_index.remove(ids)
 
     def remember_tool_by_name(self, tool_name: str) -> AgentTool:
         """Remember a tool by name and return it."""
-        tool = [tool for tool in self.tools if tool.name.lower() == tool_name.lower()]
+        tool = self._tools_by_name.get(normalize_tool_name(tool_name))
 
         if tool:
-            return tool[0]
+            return tool
         else:
             raise ToolNotFoundException(f"Tool {tool_name} not found")
 
-    def remember_relevant_tools(self, query: str) -> List[AgentTool]:
+    def remember_relevant_tools(self, query: str, k: int = 4) -> List[AgentTool]:
         """Remember relevant tools for a query."""
-        retriever = self.vector_store.as_retriever()
-        relevant_documents = retriever.get_relevant_documents(query)
-        return [self.tools[d.metadata["index"]] for d in relevant_documents]
+        if not len(self.vector_index):
+            return []
+        return self.remember_relevant_tools_by_vector(
+            self.embeddings.embed_query(query), k=k)
+
+    def remember_relevant_tools_by_vector(
+            self, embedding: List[float], k: int = 4) -> List[AgentTool]:
+        """Remember relevant tools for an embedded query."""
+        ids = [i for i, _ in self.vector_index.search(embedding, k=k)]
+        return [self._tools_by_id[i] for i in ids if i in self._tools_by_id]
 
     def remember_all_tools(self) -> List[AgentTool]:
         """Remember all tools and return them."""
         return self.tools
 
-    def _embed_docs(self) -> None:
-        """Embed tools."""
-        self.vector_store: FAISS = FAISS.from_documents(
-            self.docs, self.embeddings
-        )
+    def _embed_tools(self, tools: Dict[int, AgentTool]) -> None:
+        """Embed the descriptions of tools in one batch and replace their vectors."""
+        if not tools:
+            return
+        ids = list(tools)
+        embeddings = self.embeddings.embed_documents(
+            [tools[i].description for i in ids])
+        self.vector_index.replace(ids, embeddings)
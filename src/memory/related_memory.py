@@ -0,0 +1,39 @@
+from typing import Dict, List, Optional
+from pydantic import BaseModel, Field
+from memory.episodic_memory import EpisodicMemory, Episode
+from memory.semantic_memory import SemanticMemory
+from memory.procedual_memory import ProcedualMemory
+from tools.base import AgentTool
+
+
+class RelatedMemories(BaseModel):
+    """Memories related to one query, retrieved from every memory index."""
+    episodes: List[Episode] = Field([], description="Related past episodes")
+    knowledge: Dict[str, str] = Field({}, description="Related knowledge")
+    tools: List[AgentTool] = Field([], description="Relevant tools")
+
+
+def remember_related_memories(embedding: List[float],
+                              episodic_memory: EpisodicMemory,
+                              semantic_memory: SemanticMemory,
+                              prodedural_memory: Optional[ProcedualMemory] = None,
+                              k_episodes: int = 2,
+                              k_knowledge: int = 5,
+                              k_tools: int = 0,
+                              fresh: bool = False) -> RelatedMemories:
+    """
+    Remember related episodes, knowledge and tools to an embedded query.
+    The same query vector is searched in every memory index.
+    With fresh, the entities of the texts queued for a batched extraction
+    are extracted first.
+    """
+    related = RelatedMemories(
+        episodes=episodic_memory.remember_related_episodes_by_vector(
+            embedding, k=k_episodes),
+        knowledge=semantic_memory.remember_related_knowledge_by_vector(
+            embedding, k=k_knowledge, fresh=fresh)
+    )
+    if prodedural_memory is not None and k_tools > 0:
+        related.tools = prodedural_memory.remember_relevant_tools_by_vector(
+            embedding, k=k_tools)
+    return related
@@ -1,33 +1,161 @@
 import json
-from typing import Any, Optional
-from pydantic import BaseModel, Field
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+from pydantic import BaseModel, Field, PrivateAttr
 from langchain.llms.base import BaseLLM
 from langchain import LLMChain
-from langchain.vectorstores import VectorStore, FAISS
-from langchain.embeddings import HuggingFaceEmbeddings
-from langchain.chat_models import ChatOpenAI
-from llm.extract_entity.prompt import get_template, get_chat_template
+from langchain.vectorstores import FAISS
+from langchain.embeddings.base import Embeddings
+from memory.embeddings import get_shared_embeddings
+from memory.write_buffer import (
+    EmbeddingWriteBuffer,
+    DEFAULT_MAX_BATCH_SIZE,
+    DEFAULT_MAX_DELAY
+)
+from memory.vector_index import (
+    VectorIndex,
+    DEFAULT_ANN_NPROBE,
+    DEFAULT_ANN_THRESHOLD,
+    DEFAULT_COMPACT_AFTER
+)
+from memory.entity_table import EntityTable, ENTITY_TABLE_FILENAME, merge_descriptions
+from langchain.chat_models.base import BaseChatModel
+from llm.extract_entity.prompt import (
+    format_texts,
+    get_batch_chat_template,
+    get_batch_template,
+    get_chat_template,
+    get_template
+)
+from llm.extract_entity.schema import BatchJsonSchema as BATCH_ENTITY_EXTRACTION_SCHEMA
 from llm.extract_entity.schema import JsonSchema as ENTITY_EXTRACTION_SCHEMA
 from llm.json_output_parser import LLMJsonOutputParser, LLMJsonOutputParserException
 
 CREATE_JSON_SCHEMA_STR = json.dumps(ENTITY_EXTRACTION_SCHEMA.schema)
+BATCH_CREATE_JSON_SCHEMA_STR = json.dumps(BATCH_ENTITY_EXTRACTION_SCHEMA.schema)
+DEFAULT_MAX_CHUNK_WORKERS = 4
 
 
 class SemanticMemory(BaseModel):
     num_episodes: int = Field(0, description="The number of episodes")
     llm: BaseLLM = Field(..., description="llm class for the agent")
-    openaichat: Optional[ChatOpenAI] = Field(
+    openaichat: Optional[BaseChatModel] = Field(
         None, description="ChatOpenAI class for the agent")
-    embeddings: HuggingFaceEmbeddings = Field(
-        HuggingFaceEmbeddings(), title="Embeddings to use for tool retrieval")
-    vector_store: VectorStore = Field(
-        None, title="Vector store to use for tool retrieval")
+    embeddings: Embeddings = Field(
+        default_factory=get_shared_embeddings,
+        title="Embeddings to use for tool retrieval")
+    vector_index: VectorIndex = Field(
+        default_factory=VectorIndex, title="Vector index of the entity descriptions")
+    entities: EntityTable = Field(
+        default_factory=EntityTable, title="Entities keyed by their normalized name")
+    write_batch_size: int = Field(
+        DEFAULT_MAX_BATCH_SIZE,
+        description="The number of entities embedded in one batch")
+    write_max_delay: float = Field(
+        DEFAULT_MAX_DELAY, description="The seconds an entity may wait to be embedded")
+    extraction_batch_steps: int = Field(
+        1,
+        description="The number of texts whose entities are extracted in one LLM call")
+    extraction_batch_chars: Optional[int] = Field(
+        None,
+        description="The number of queued characters that triggers the extraction "
+                    "before the batch is full, or None")
+    index_compact_after: int = Field(
+        DEFAULT_COMPACT_AFTER,
+        description="The logged vectors after which the saved vector index is "
+                    "rewritten")
+    ann_threshold: Optional[int] = Field(
+        DEFAULT_ANN_THRESHOLD,
+        description="The vectors from which an IVF index is built, "
+                    "or None to stay flat")
+    ann_nprobe: int = Field(
+        DEFAULT_ANN_NPROBE, description="The IVF lists searched for each query")
+    _write_buffer: EmbeddingWriteBuffer = PrivateAttr()
+    _pending_texts: List[str] = PrivateAttr(default_factory=list)
+    # The description versions in the vector index since it was last saved, by entity id
+    _embedded_versions: Dict[int, int] = PrivateAttr(default_factory=dict)
+    _extraction_lock: threading.RLock = PrivateAttr(default_factory=threading.RLock)
 
     class Config:
         arbitrary_types_allowed = True
 
+    def __init__(self, **data: Any) -> None:
+        super().__init__(**data)
+        if "vector_index" not in data:
+            self.vector_index = VectorIndex(**self._index_settings())
+        self._write_buffer = EmbeddingWriteBuffer(
+            embeddings=self.embeddings,
+            sink=self._add_embeddings,
+            max_batch_size=self.write_batch_size,
+            max_delay=self.write_max_delay)
+
     def extract_entity(self, text: str) -> dict:
-        """Extract an entity from a text using the LLM"""
+        """
+        Extract an entity from a text using the LLM.
+        When extraction is batched, the text is queued and the entities of the
+        whole batch are returned once it is extracted, and an empty dict before.
+        """
+        with self._extraction_lock:
+            # Texts without any content have nothing to extract.
+            if text.strip():
+                self._pending_texts.append(text)
+            num_chars = sum(len(t) for t in self._pending_texts)
+            if len(self._pending_texts) < self.extraction_batch_steps and (
+                    self.extraction_batch_chars is None
+                    or num_chars < self.extraction_batch_chars):
+                return {}
+            entities = {}
+            for _, extracted in self.flush_extraction():
+                entities.update(extracted)
+            return entities
+
+    def extract_entity_from_chunks(
+            self, chunks: List[str],
+            max_workers: int = DEFAULT_MAX_CHUNK_WORKERS) -> dict:
+        """
+        Extract the entities of a large text split into chunks, in parallel,
+        and memorize them.
+        The descriptions an entity gets from several chunks are merged.
+        """
+        chunks = [chunk for chunk in chunks if chunk.strip()]
+        with ThreadPoolExecutor(
+                max_workers=max_workers,
+                thread_name_prefix="extract-chunk") as executor:
+            extracted = list(executor.map(self._extract_entities, chunks))
+        entities: Dict[str, str] = {}
+        for chunk_entities in extracted:
+            for name, description in chunk_entities.items():
+                entities[name] = merge_descriptions(entities[name], str(description)) \
+                    if name in entities else str(description)
+        with self._extraction_lock:
+            self._embed_knowledge(entities)
+        return entities
+
+    def flush_extraction(self) -> List[Tuple[str, dict]]:
+        """
+        Extract the entities of the queued texts in one LLM call and memorize them.
+        Returns each text with the entities extracted from it.
+        If the extraction fails, the texts stay queued for the next one.
+        """
+        with self._extraction_lock:
+            texts = self._pending_texts
+            if not texts:
+                return []
+            # The texts stay queued until they are extracted,
+            # so a failed call loses none.
+            if len(texts) == 1:
+                extracted = [self._extract_entities(texts[0])]
+            else:
+                extracted = self._extract_batch_entities(texts)
+            self._pending_texts = []
+            for entities in extracted:
+                self._embed_knowledge(entities)
+            return list(zip(texts, extracted))
+
+    def _extract_entities(self, text: str) -> dict:
+        """Extract the entities of one text."""
         if self.openaichat:
             # If OpenAI Chat is available, it is used for higher accuracy results.
             propmt = get_chat_template().format_prompt(text=text).to_messages()
@@ -42,50 +170,159 @@ class SemanticMemory(BaseModel):
 
         # Parse and validate the result
         try:
-            result_json_obj = LLMJsonOutputParser.parse_and_validate(
+            return LLMJsonOutputParser.parse_and_validate(
                 json_str=result,
                 json_schema=CREATE_JSON_SCHEMA_STR,
                 llm=self.llm
             )
         except LLMJsonOutputParserException as e:
             raise LLMJsonOutputParserException(str(e))
+
+    def _extract_batch_entities(self, texts: List[str]) -> List[dict]:
+        """
+        Extract the entities of numbered texts in one prompt,
+        and attribute them to their text.
+        If the response does not key the entities by text number,
+        the texts are extracted one by one.
+        """
+        if self.openaichat:
+            propmt = get_batch_chat_template().format_prompt(
+                texts=format_texts(texts)).to_messages()
+            result = self.openaichat(propmt).content
         else:
-            self._embed_knowledge(result_json_obj)
-            return result_json_obj
+            llm_chain = LLMChain(prompt=get_batch_template(), llm=self.llm)
+            try:
+                result = llm_chain.predict(texts=format_texts(texts))
+            except Exception as e:
+                raise Exception(f"Error: {e}")
 
-    def remember_related_knowledge(self, query: str, k: int = 5) -> dict:
-        """Remember relevant knowledge for a query."""
-        if self.vector_store is None:
+        try:
+            result_json_obj = LLMJsonOutputParser.parse_and_validate(
+                json_str=result,
+                json_schema=BATCH_CREATE_JSON_SCHEMA_STR,
+                llm=self.llm
+            )
+        except LLMJsonOutputParserException as e:
+            raise LLMJsonOutputParserException(str(e))
+
+        extracted: List[dict] = [{} for _ in texts]
+        if not isinstance(result_json_obj, dict):
+            return extracted
+        for key, entities in result_json_obj.items():
+            number = str(key).strip().strip("[]")
+            if number.isdigit() and 1 <= int(number) <= len(texts) \
+                    and isinstance(entities, dict):
+                extracted[int(number) - 1].update(entities)
+            elif isinstance(entities, str):
+                # Entities not keyed by their text number cannot be attributed
+                # to a text,
+                # so each text is extracted on its own.
+                return [self._extract_entities(text) for text in texts]
+        return extracted
+
+    def remember_related_knowledge(
+            self, query: str, k: int = 5, fresh: bool = False) -> dict:
+        """
+        Remember relevant knowledge for a query.
+        With fresh, the entities of the queued texts are extracted first.
+        """
+        if fresh:
+            self.flush_extraction()
+        if not len(self.vector_index) and not len(self._write_buffer):
             return {}
-        relevant_documents = self.vector_store.similarity_search(query, k=k)
-        return {d.metadata["entity"]: d.metadata["description"] for d in relevant_documents}
+        return self.remember_related_knowledge_by_vector(
+            self.embeddings.embed_query(query), k=k)
+
+    def remember_related_knowledge_by_vector(
+            self, embedding: List[float], k: int = 5, fresh: bool = False) -> dict:
+        """
+        Remember relevant knowledge for an embedded query.
+        With fresh, the entities of the queued texts are extracted first.
+        """
+        if fresh:
+            self.flush_extraction()
+        with self._write_buffer.lock:
+            self._write_buffer.flush()
+            ids = [i for i, _ in self.vector_index.search(embedding, k=k)]
+        entities = self.entities.get_by_ids(ids)
+        return {entities[i].name: entities[i].description for i in ids if i in entities}
 
     def _embed_knowledge(self, entity: dict[str:Any]) -> None:
-        """Embed the knowledge into the vector store."""
+        """Upsert the knowledge and queue the changed descriptions to be embedded."""
         description_list = []
         metadata_list = []
 
-        for entity, description in entity.items():
-            description_list.append(description)
-            metadata_list.append({"entity": entity, "description": description})
+        for name, description in entity.items():
+            changed = self.entities.upsert(str(name), str(description))
+            if changed is None:
+                continue
+            description_list.append(changed.description)
+            metadata_list.append({"id": changed.id, "version": changed.version})
 
-        if self.vector_store is None:
-            self.vector_store = FAISS.from_texts(
-                texts=description_list,
-                metadatas=metadata_list,
-                embedding=self.embeddings
-            )
-        else:
-            self.vector_store.add_texts(
-                texts=description_list,
-                metadatas=metadata_list
-            )
+        self._write_buffer.add(texts=description_list, metadatas=metadata_list)
+
+    def _add_embeddings(self, texts: List[str], embeddings: List[List[float]],
+                        metadatas: List[Dict[str, Any]]) -> None:
+        """Replace the vectors of the embedded entities in the vector index."""
+        # An entity updated twice in one batch keeps only its latest vector.
+        latest = {m["id"]: e for m, e in zip(metadatas, embeddings)}
+        self.vector_index.replace(list(latest.keys()), list(latest.values()))
+        for m in metadatas:
+            self._embedded_versions[m["id"]] = max(
+                m["version"], self._embedded_versions.get(m["id"], 0))
+
+    def _index_settings(self) -> Dict[str, Any]:
+        """Get the settings the vector index is created and loaded with."""
+        return {
+            "compact_after": self.index_compact_after,
+            "ann_threshold": self.ann_threshold,
+            "ann_nprobe": self.ann_nprobe,
+        }
+
+    def flush(self) -> None:
+        """Embed the queued knowledge now."""
+        self._write_buffer.flush()
 
     def save_local(self, path: str) -> None:
-        """Save the vector store to a local folder."""
-        self.vector_store.save_local(folder_path=path)
+        """
+        Save the vector index and the entities to a local folder,
+        extracting the queued texts first.
+        """
+        self.flush_extraction()
+        with self._write_buffer.lock:
+            self._write_buffer.flush()
+            self.vector_index.save_local(path)
+            self.entities.attach(os.path.join(path, ENTITY_TABLE_FILENAME))
+            self.entities.mark_saved(self._embedded_versions)
+            self._embedded_versions = {}
+
+    def load_local(self, path: str, mmap: bool = False) -> None:
+        """
+        Load the vector index and the entities from a local folder,
+        memory-mapping the index if mmap is set.
+        """
+        entity_table_path = os.path.join(path, ENTITY_TABLE_FILENAME)
+        legacy_path = os.path.join(path, "index.pkl")
+        if not os.path.exists(entity_table_path) and os.path.exists(legacy_path):
+            self._load_legacy(path)
+            return
+        self.vector_index = VectorIndex.load_local(
+            path, mmap=mmap, **self._index_settings())
+        self.entities = EntityTable(entity_table_path)
+
+        # Entities written after the index was last saved are embedded again.
+        last_id = max(self.vector_index.ids(), default=0)
+        entities = {entity.id: entity for entity in self.entities.unsaved()}
+        entities.update((entity.id, entity) for entity in self.entities.after(last_id))
+        self._write_buffer.add(
+            texts=[entity.description for entity in entities.values()],
+            metadatas=[{"id": entity.id, "version": entity.version}
+                       for entity in entities.values()])
 
-    def load_local(self, path: str) -> None:
-        """Load the vector store from a local folder."""
-        self.vector_store = FAISS.load_local(
-            folder_path=path, embeddings=self.embeddings)
+    def _load_legacy(self, path: str) -> None:
+        """Upsert the knowledge saved by the former LangChain FAISS vector store."""
+        vector_store = FAISS.load_local(folder_path=path, embeddings=self.embeddings)
+        for doc_id in vector_store.index_to_docstore_id.values():
+            doc = vector_store.docstore.search(doc_id)
+            self._embed_knowledge({doc.metadata["entity"]: doc.metadata["description"]})
+        self.flush()
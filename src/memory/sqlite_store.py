@@ -0,0 +1,39 @@
+import os
+import sqlite3
+import threading
+from typing import Optional
+
+
+class SqliteStore:
+    """
+    Base class for the SQLite tables of the memories.
+    The database lives in memory until it is attached to a file, after which
+    every write goes straight to that file.
+    """
+    schema: str = ""
+
+    def __init__(self, path: Optional[str] = None) -> None:
+        self.path = os.path.abspath(path) if path else None
+        self.lock = threading.RLock()
+        self.conn = self._connect(self.path or ":memory:")
+        self.conn.executescript(self.schema)
+        self.conn.commit()
+
+    @staticmethod
+    def _connect(path: str) -> sqlite3.Connection:
+        return sqlite3.connect(path, check_same_thread=False)
+
+    def attach(self, path: str) -> None:
+        """Copy the database to a file and keep writing to that file."""
+        path = os.path.abspath(path)
+        with self.lock:
+            if self.path == path:
+                self.conn.commit()
+                return
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            conn = self._connect(path)
+            self.conn.commit()
+            self.conn.backup(conn)
+            self.conn.close()
+            self.conn = conn
+            self.path = path
@@ -0,0 +1,380 @@
+import base64
+import json
+import math
+import os
+import threading
+from typing import Any, Dict, List, Optional, Set, Tuple
+import numpy as np
+
+VECTOR_INDEX_FILENAME = "vectors.faiss"
+VECTOR_WAL_FILENAME = "vectors.wal"
+DEFAULT_COMPACT_AFTER = 1000
+DEFAULT_ANN_THRESHOLD = 20000
+DEFAULT_ANN_NPROBE = 16
+# The ANN index is rebuilt when the number of vectors grows by this factor.
+ANN_REBUILD_GROWTH = 4
+
+
+def dependable_faiss_import() -> Any:
+    """Import faiss if available, otherwise raise error."""
+    try:
+        import faiss
+    except ImportError:
+        raise ValueError(
+            "Could not import faiss python package. "
+            "Please install it with `pip install faiss-cpu`."
+        )
+    return faiss
+
+
+class VectorIndex:
+    """
+    FAISS index addressed by integer ids.
+    Unlike the LangChain FAISS wrapper, vectors can be removed and replaced.
+
+    Saving is incremental: changes since the last save are appended to a
+    write-ahead log next to the snapshot, and the snapshot is only rewritten
+    once the log holds more than `compact_after` vectors.
+
+    A memory-mapped snapshot is never modified: vectors added to it go to a
+    small in-memory delta index searched next to it, and its removed vectors
+    are masked, until the index is read into memory to be compacted.
+
+    The index starts flat. Once it holds `ann_threshold` vectors, an IVF index
+    is built in a background thread and swapped in when it is ready, and it
+    is rebuilt whenever the number of vectors grows by ANN_REBUILD_GROWTH.
+    """
+
+    def __init__(self,
+                 index: Any = None,
+                 compact_after: int = DEFAULT_COMPACT_AFTER,
+                 ann_threshold: Optional[int] = DEFAULT_ANN_THRESHOLD,
+                 ann_nprobe: int = DEFAULT_ANN_NPROBE) -> None:
+        self.index = index
+        self.compact_after = compact_after
+        self.ann_threshold = ann_threshold
+        self.ann_nprobe = ann_nprobe
+        self._lock = threading.RLock()
+        # The running ANN build, the changes made while it runs,
+        # and the size it was built at.
+        self._ann_build: Optional[threading.Thread] = None
+        self._ann_pending: Optional[
+            List[Tuple[str, np.ndarray, Optional[np.ndarray]]]] = None
+        self._ann_size = 0
+        # Changes not saved yet, and where and how much was logged since the snapshot.
+        self._journal: List[Dict[str, Any]] = []
+        self._saved_path: Optional[str] = None
+        self._wal_size = 0
+        # The snapshot file the index is memory-mapped from, if any, with the vectors
+        # added since it was mapped, and the ids removed from it.
+        self._mapped_filename: Optional[str] = None
+        self._delta: Any = None
+        self._deleted: Set[int] = set()
+        self._mapped_ids: Optional[Set[int]] = None
+
+    def __len__(self) -> int:
+        if self.index is None:
+            return 0
+        num_delta = 0 if self._delta is None else self._delta.ntotal
+        return self.index.ntotal - len(self._deleted) + num_delta
+
+    def ids(self) -> List[int]:
+        """Get the ids in the index."""
+        with self._lock:
+            return self._snapshot(with_vectors=False)[0].tolist()
+
+    def _snapshot(
+            self, with_vectors: bool = True) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+        """Get the ids and, optionally, the vectors in the index."""
+        ids, vectors = self._index_snapshot(self.index, with_vectors)
+        if self._deleted:
+            keep = ~np.isin(ids, np.fromiter(self._deleted, dtype=np.int64))
+            ids, vectors = ids[keep], vectors[keep] if with_vectors else None
+        if self._delta is not None:
+            delta_ids, delta_vectors = self._index_snapshot(self._delta, with_vectors)
+            ids = np.concatenate([ids, delta_ids])
+            vectors = np.concatenate([vectors, delta_vectors]) if with_vectors else None
+        return ids, vectors
+
+    @staticmethod
+    def _index_snapshot(
+            index: Any, with_vectors: bool) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+        """Get the ids and, optionally, the vectors in a FAISS index."""
+        if index is None:
+            return np.array([], dtype=np.int64), None
+        faiss = dependable_faiss_import()
+        if not isinstance(index, faiss.IndexIVF):
+            ids = faiss.vector_to_array(index.id_map)
+            vectors = None
+            if with_vectors:
+                vectors = index.index.reconstruct_n(0, index.ntotal)
+            return ids, vectors
+
+        # IVF-Flat inverted lists hold the ids and the raw vectors of each list.
+        invlists = index.invlists
+        ids = [np.array([], dtype=np.int64)]
+        vectors = [np.zeros((0, index.d), dtype=np.float32)]
+        for list_no in range(index.nlist):
+            size = invlists.list_size(list_no)
+            if size == 0:
+                continue
+            ids.append(faiss.rev_swig_ptr(invlists.get_ids(list_no), size).copy())
+            if with_vectors:
+                codes = faiss.rev_swig_ptr(
+                    invlists.get_codes(list_no), size * invlists.code_size)
+                vectors.append(codes.copy().view(np.float32).reshape(size, index.d))
+        return np.concatenate(ids), np.concatenate(vectors) if with_vectors else None
+
+    def _create_index(self, dim: int) -> Any:
+        """Create an empty flat index."""
+        faiss = dependable_faiss_import()
+        return faiss.IndexIDMap2(faiss.IndexFlatL2(dim))
+
+    def add(self, ids: List[int], vectors: List[List[float]]) -> None:
+        """Add vectors with their ids."""
+        if not ids:
+            return
+        vectors = np.array(vectors, dtype=np.float32)
+        with self._lock:
+            self._add(np.array(ids, dtype=np.int64), vectors)
+            self._journal.append({"op": "add", "ids": list(ids), "vectors": vectors})
+            self._maybe_build_ann()
+
+    def _add(self, ids: np.ndarray, vectors: np.ndarray) -> None:
+        if self.index is None:
+            self.index = self._create_index(vectors.shape[1])
+        if self._mapped_filename is not None:
+            if self._delta is None:
+                self._delta = self._create_index(vectors.shape[1])
+            self._delta.add_with_ids(vectors, ids)
+        else:
+            self.index.add_with_ids(vectors, ids)
+        if self._ann_pending is not None:
+            self._ann_pending.append(("add", ids, vectors))
+
+    def _remove(self, ids: np.ndarray) -> None:
+        if self._mapped_filename is not None:
+            if self._delta is not None:
+                self._delta.remove_ids(ids)
+            if self._mapped_ids is None:
+                mapped_ids = self._index_snapshot(self.index, with_vectors=False)[0]
+                self._mapped_ids = set(mapped_ids.tolist())
+            self._deleted.update(i for i in ids.tolist() if i in self._mapped_ids)
+        else:
+            self.index.remove_ids(ids)
+        if self._ann_pending is not None:
+            self._ann_pending.append(("remove", ids, None))
+
+    def _maybe_build_ann(self) -> None:
+        """Start building an ANN index in the background if the index grew enough."""
+        if self.ann_threshold is None or self._ann_build is not None:
+            return
+        if len(self) < max(self.ann_threshold, self._ann_size * ANN_REBUILD_GROWTH):
+            return
+        ids, vectors = self._snapshot()
+        self._ann_size = len(ids)
+        self._ann_pending = []
+        self._ann_build = threading.Thread(
+            target=self._build_ann, args=(ids, vectors), daemon=True)
+        self._ann_build.start()
+
+    def _build_ann(self, ids: np.ndarray, vectors: np.ndarray) -> None:
+        """Build an IVF index and swap it in, replaying the changes made meanwhile."""
+        faiss = dependable_faiss_import()
+        try:
+            nlist = max(1, int(math.sqrt(len(ids))))
+            dim = vectors.shape[1]
+            index = faiss.IndexIVFFlat(faiss.IndexFlatL2(dim), dim, nlist)
+            index.train(vectors)
+            index.add_with_ids(vectors, ids)
+            index.nprobe = min(self.ann_nprobe, nlist)
+            with self._lock:
+                for op, op_ids, op_vectors in self._ann_pending:
+                    if op == "add":
+                        index.add_with_ids(op_vectors, op_ids)
+                    else:
+                        index.remove_ids(op_ids)
+                self.index = index
+                self._unmap()
+        finally:
+            with self._lock:
+                self._ann_pending = None
+                self._ann_build = None
+
+    def wait_for_ann(self) -> None:
+        """Wait for a running ANN build to be swapped in."""
+        build = self._ann_build
+        if build is not None:
+            build.join()
+
+    def _hydrate(self) -> None:
+        """
+        Read a memory-mapped index into memory,
+        merging the changes made since it was mapped.
+        """
+        if self._mapped_filename is None:
+            return
+        # Memory-mapped vectors are read-only views of the snapshot file.
+        faiss = dependable_faiss_import()
+        index = faiss.read_index(self._mapped_filename)
+        if self._deleted:
+            index.remove_ids(np.fromiter(self._deleted, dtype=np.int64))
+        if self._delta is not None and self._delta.ntotal:
+            delta_ids, delta_vectors = self._index_snapshot(
+                self._delta, with_vectors=True)
+            index.add_with_ids(delta_vectors, delta_ids)
+        self.index = index
+        self._unmap()
+
+    def _unmap(self) -> None:
+        """Forget the memory-mapped snapshot and its changes, now in the index."""
+        self._mapped_filename = None
+        self._delta = None
+        self._deleted = set()
+        self._mapped_ids = None
+
+    def remove(self, ids: List[int]) -> None:
+        """Remove the vectors of the ids, ignoring unknown ids."""
+        with self._lock:
+            if self.index is None or not ids:
+                return
+            self._remove(np.array(ids, dtype=np.int64))
+            self._journal.append({"op": "remove", "ids": list(ids)})
+
+    def replace(self, ids: List[int], vectors: List[List[float]]) -> None:
+        """Replace the vectors of the ids, adding the ones not in the index."""
+        with self._lock:
+            self.remove(ids)
+            self.add(ids, vectors)
+
+    def search(self, vector: List[float], k: int = 4) -> List[Tuple[int, float]]:
+        """Search the ids and distances of the k nearest vectors."""
+        query = np.array([vector], dtype=np.float32)
+        with self._lock:
+            if not len(self):
+                return []
+            if self._delta is None and not self._deleted:
+                distances, ids = self.index.search(query, k)
+                return [(int(i), float(d)) for i, d in zip(ids[0], distances[0])
+                        if i != -1]
+            # The masked vectors of the mapped snapshot are searched past, and the delta
+            # is merged in.
+            distances, ids = self.index.search(query, k + len(self._deleted))
+            results = [(int(i), float(d)) for i, d in zip(ids[0], distances[0])
+                       if i != -1 and int(i) not in self._deleted]
+            if self._delta is not None and self._delta.ntotal:
+                distances, ids = self._delta.search(query, k)
+                results += [(int(i), float(d)) for i, d in zip(ids[0], distances[0])
+                            if i != -1]
+        return sorted(results, key=lambda result: result[1])[:k]
+
+    def save_local(self, path: str) -> None:
+        """Save the changes since the last save, compacting the log if too large."""
+        path = os.path.abspath(path)
+        os.makedirs(path, exist_ok=True)
+        with self._lock:
+            pending = sum(len(record["ids"]) for record in self._journal)
+            if (self._saved_path != path
+                    or self._wal_size + pending > self.compact_after
+                    or not os.path.exists(os.path.join(path, VECTOR_INDEX_FILENAME))):
+                self._write_snapshot(path)
+            elif self._journal:
+                self._append_wal(path)
+                self._wal_size += pending
+            self._journal = []
+
+    def _write_snapshot(self, path: str) -> None:
+        """Write the whole index and truncate the write-ahead log."""
+        faiss = dependable_faiss_import()
+        if self._delta is not None or self._deleted:
+            self._hydrate()
+        if self.index is not None:
+            tmp_filename = os.path.join(path, VECTOR_INDEX_FILENAME + ".tmp")
+            faiss.write_index(self.index, tmp_filename)
+            os.replace(tmp_filename, os.path.join(path, VECTOR_INDEX_FILENAME))
+        with open(os.path.join(path, VECTOR_WAL_FILENAME), "w"):
+            pass
+        self._saved_path = path
+        self._wal_size = 0
+
+    def _append_wal(self, path: str) -> None:
+        """Append the journal to the write-ahead log."""
+        with open(os.path.join(path, VECTOR_WAL_FILENAME), "a") as f:
+            for record in self._journal:
+                line = {"op": record["op"], "ids": record["ids"]}
+                if record["op"] == "add":
+                    line["dim"] = int(record["vectors"].shape[1])
+                    line["vectors"] = base64.b64encode(
+                        record["vectors"].tobytes()).decode()
+                f.write(json.dumps(line) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    @classmethod
+    def load_local(cls,
+                   path: str,
+                   compact_after: int = DEFAULT_COMPACT_AFTER,
+                   mmap: bool = False,
+                   ann_threshold: Optional[int] = DEFAULT_ANN_THRESHOLD,
+                   ann_nprobe: int = DEFAULT_ANN_NPROBE) -> "VectorIndex":
+        """
+        Load the snapshot from a local folder and replay its write-ahead log.
+        With mmap, the snapshot is memory-mapped instead of read into memory,
+        so pages are only read when searched and are shared across processes.
+        The logged changes and later ones are kept in memory next to it, and
+        the index is only read into memory when the snapshot is compacted.
+        """
+        path = os.path.abspath(path)
+        vector_index = cls(
+            compact_after=compact_after, ann_threshold=ann_threshold,
+            ann_nprobe=ann_nprobe)
+        filename = os.path.join(path, VECTOR_INDEX_FILENAME)
+        if not os.path.exists(filename):
+            return vector_index
+        faiss = dependable_faiss_import()
+        if mmap:
+            # Older faiss versions only know the flag that maps inverted lists.
+            io_flags = getattr(faiss, "IO_FLAG_MMAP_IFC", faiss.IO_FLAG_MMAP)
+            vector_index.index = faiss.read_index(filename, io_flags)
+            vector_index._mapped_filename = filename
+        else:
+            vector_index.index = faiss.read_index(filename)
+        if isinstance(vector_index.index, faiss.IndexIVF):
+            vector_index._ann_size = vector_index.index.ntotal
+        vector_index._saved_path = path
+        vector_index._wal_size = vector_index._replay_wal(path)
+        vector_index._maybe_build_ann()
+        return vector_index
+
+    def _replay_wal(self, path: str) -> int:
+        """
+        Apply the write-ahead log to the index and return the logged vector count.
+        A torn last record from an interrupted save is cut off the log, so later
+        records are appended after the last complete one.
+        """
+        wal_filename = os.path.join(path, VECTOR_WAL_FILENAME)
+        if not os.path.exists(wal_filename):
+            return 0
+        size = 0
+        offset = 0
+        with open(wal_filename, "rb") as f:
+            for line in f:
+                try:
+                    if not line.endswith(b"\n"):
+                        raise ValueError("Incomplete record")
+                    record = json.loads(line)
+                except ValueError:
+                    # A torn last line from an interrupted save.
+                    break
+                ids = np.array(record["ids"], dtype=np.int64)
+                if record["op"] == "add":
+                    vectors = np.frombuffer(
+                        base64.b64decode(record["vectors"]), dtype=np.float32)
+                    self._add(ids, vectors.reshape(-1, record["dim"]))
+                elif self.index is not None:
+                    self._remove(ids)
+                size += len(ids)
+                offset += len(line)
+        if offset < os.path.getsize(wal_filename):
+            os.truncate(wal_filename, offset)
+        return size
@@ -0,0 +1,58 @@
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+from langchain.embeddings.base import Embeddings
+
+DEFAULT_MAX_BATCH_SIZE = 64
+DEFAULT_MAX_DELAY = 30.0
+
+# The sink receives the texts, their vectors and their metadatas of one batch.
+Sink = Callable[[List[str], List[List[float]], List[Dict[str, Any]]], None]
+
+
+class EmbeddingWriteBuffer:
+    """
+    Write-behind buffer that embeds queued texts in large batches.
+    The queue is flushed when it reaches the batch size, when the oldest entry
+    is older than the maximum delay, or when a reader calls flush().
+    Readers hold the lock while they flush and search to read their writes.
+    """
+
+    def __init__(self,
+                 embeddings: Embeddings,
+                 sink: Sink,
+                 max_batch_size: int = DEFAULT_MAX_BATCH_SIZE,
+                 max_delay: float = DEFAULT_MAX_DELAY) -> None:
+        self.embeddings = embeddings
+        self.sink = sink
+        self.max_batch_size = max_batch_size
+        self.max_delay = max_delay
+        self._texts: List[str] = []
+        self._metadatas: List[Dict[str, Any]] = []
+        self._oldest: Optional[float] = None
+        self.lock = threading.RLock()
+
+    def __len__(self) -> int:
+        return len(self._texts)
+
+    def add(self, texts: List[str], metadatas: List[Dict[str, Any]]) -> None:
+        """Queue texts and their metadatas, flushing if a threshold is reached."""
+        with self.lock:
+            if self._oldest is None:
+                self._oldest = time.monotonic()
+            self._texts.extend(texts)
+            self._metadatas.extend(metadatas)
+            if (len(self._texts) >= self.max_batch_size
+                    or time.monotonic() - self._oldest >= self.max_delay):
+                self.flush()
+
+    def flush(self) -> None:
+        """Embed every queued text in one batch and hand it to the sink."""
+        with self.lock:
+            if not self._texts:
+                return
+            texts, metadatas = self._texts, self._metadatas
+            vectors = self.embeddings.embed_documents(texts)
+            self.sink(texts, vectors, metadatas)
+            self._texts, self._metadatas = [], []
+            self._oldest = None
@@ -0,0 +1,21 @@
+import hashlib
+from typing import List
+import numpy as np
+import pytest
+from langchain.embeddings.base import Embeddings
+
+
+class HashEmbeddings(Embeddings):
+    """Deterministic embeddings derived from a hash of the text."""
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return [self.embed_query(text) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        seed = int(hashlib.md5(text.encode()).hexdigest()[:8], 16)
+        return np.random.RandomState(seed).rand(8).astype(np.float32).tolist()
+
+
+@pytest.fixture
+def embeddings() -> HashEmbeddings:
+    return HashEmbeddings()
@@ -0,0 +1,37 @@
+import pytest
+from llm.json_repair import JsonRepairError, repair_json
+
+# Text as LLMs write it, whether the JSON is expected to be an object,
+# and the value it is repaired to
+REPAIR_CASES = [
+    ('{"a": 1}', False, {"a": 1}),
+    ('Here you go:\n```json\n{"a": "x"}\n```', False, {"a": "x"}),
+    ('[RESPONSE]\n{"Tokyo": "capital of Japan"}', False, {"Tokyo": "capital of Japan"}),
+    ('[JSON RESPONSE FORMAT]\n[RESPONSE]\n{"a": 1}', False, {"a": 1}),
+    ('[RESPONSE]\n{"a": [1, 2]}', True, {"a": [1, 2]}),
+    ('["x", "y"]', False, ["x", "y"]),
+    ("{'a': 'x', 'b': True, 'c': None}", False, {"a": "x", "b": True, "c": None}),
+    ('{a: "x", b: 2}', False, {"a": "x", "b": 2}),
+    ('{"a": yes please}', False, {"a": "yes please"}),
+    ('{"a": "x",}', False, {"a": "x"}),
+    ('{"a": "x"\n "b": "y"}', False, {"a": "x", "b": "y"}),
+    ('{"a": "x" "b": "y"}', False, {"a": "x", "b": "y"}),
+    ('{"a": 1 "b": 2}', False, {"a": 1, "b": 2}),
+    ('{"a": true\n"b": null}', False, {"a": True, "b": None}),
+    ('{"a": "he said "hi" to me"}', False, {"a": 'he said "hi" to me'}),
+    ('{"a": "C:\\path"}', False, {"a": "C:\\path"}),
+    ('{"a": {"b": "x"', False, {"a": {"b": "x"}}),
+    ('{"a": [1, 2}', False, {"a": [1, 2]}),
+]
+
+
+@pytest.mark.parametrize("text, expect_object, expected", REPAIR_CASES)
+def test_repair_json(text, expect_object, expected):
+    value, _ = repair_json(text, expect_object)
+    assert value == expected
+
+
+@pytest.mark.parametrize("text", ["no json here", '{"a": "x", : "y"}'])
+def test_repair_json_fails(text):
+    with pytest.raises(JsonRepairError):
+        repair_json(text)
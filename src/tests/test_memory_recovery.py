@@ -0,0 +1,77 @@
+import pytest
+from langchain.llms.fake import FakeListLLM
+
+# The memories parse LLM output with marvin as the last resort.
+pytest.importorskip("marvin")
+
+from memory.episodic_memory import EpisodicMemory, Episode  # noqa: E402
+from memory.semantic_memory import SemanticMemory  # noqa: E402
+
+
+def _vector_distance(memory, embeddings, text):
+    """Get the distance from the embedding of a text to its nearest memory vector."""
+    memory.flush()
+    return memory.vector_index.search(embeddings.embed_query(text), k=1)[0][1]
+
+
+def test_semantic_memory_reembeds_descriptions_merged_after_save(tmp_path, embeddings):
+    memory = SemanticMemory(llm=FakeListLLM(responses=[""]), embeddings=embeddings)
+    memory._embed_knowledge({"Tokyo": "The capital of Japan."})
+    memory.save_local(str(tmp_path))
+    # The merged description reaches the entity table,
+    # then the process dies before saving.
+    memory._embed_knowledge({"Tokyo": "The largest city of Japan."})
+    merged = memory.entities.get("Tokyo").description
+
+    loaded = SemanticMemory(llm=FakeListLLM(responses=[""]), embeddings=embeddings)
+    loaded.load_local(str(tmp_path))
+    assert _vector_distance(loaded, embeddings, merged) == pytest.approx(0)
+
+    # Once saved, the description is not embedded again.
+    loaded.save_local(str(tmp_path))
+    assert loaded.entities.unsaved() == []
+    reloaded = SemanticMemory(llm=FakeListLLM(responses=[""]), embeddings=embeddings)
+    reloaded.load_local(str(tmp_path))
+    assert len(reloaded._write_buffer) == 0
+
+
+def test_episodic_memory_reconciles_consolidation_after_save(tmp_path, embeddings):
+    memory = EpisodicMemory(
+        llm=FakeListLLM(responses=["Consolidated summary."]), embeddings=embeddings,
+        retention_max_episodes=None, retention_keep_recent=0,
+        consolidation_batch_size=3)
+    for i in range(4):
+        memory.memorize_episode(
+            Episode(thoughts={}, action={}, result="result", summary=f"Summary {i}."))
+    memory.save_local(str(tmp_path))
+    # The oldest episodes are consolidated, then the process dies before saving.
+    memory.retention_max_episodes = 2
+    assert memory.consolidate() == 1
+    ids = [episode_id for episode_id, _ in memory.log.all()]
+
+    loaded = EpisodicMemory(llm=FakeListLLM(responses=[""]), embeddings=embeddings)
+    loaded.load_local(str(tmp_path))
+    loaded.flush()
+    assert sorted(loaded.vector_index.ids()) == ids
+    nearest = loaded.remember_related_episodes_by_vector(
+        embeddings.embed_query("Consolidated summary."), k=1)
+    assert [episode.summary for episode in nearest] == ["Consolidated summary."]
+
+    loaded.save_local(str(tmp_path))
+    assert loaded.log.unsaved() == []
+
+
+def test_memories_keep_their_index_settings_on_load(tmp_path, embeddings):
+    settings = {"index_compact_after": 10, "ann_threshold": None, "ann_nprobe": 4}
+    memories = [
+        EpisodicMemory(
+            llm=FakeListLLM(responses=[""]), embeddings=embeddings, **settings),
+        SemanticMemory(
+            llm=FakeListLLM(responses=[""]), embeddings=embeddings, **settings),
+    ]
+    for memory in memories:
+        memory.save_local(str(tmp_path / type(memory).__name__))
+        memory.load_local(str(tmp_path / type(memory).__name__))
+        index = memory.vector_index
+        index_settings = (index.compact_after, index.ann_threshold, index.ann_nprobe)
+        assert index_settings == (10, None, 4)
@@ -0,0 +1,34 @@
+import pytest
+from langchain.llms.fake import FakeListLLM
+
+# The memories parse LLM output with marvin as the last resort.
+pytest.importorskip("marvin")
+
+from memory.semantic_memory import SemanticMemory  # noqa: E402
+
+
+def test_failed_batch_extraction_keeps_texts_queued(embeddings):
+    memory = SemanticMemory(
+        llm=FakeListLLM(responses=[]), embeddings=embeddings, extraction_batch_steps=2)
+    assert memory.extract_entity("Tokyo is the capital of Japan.") == {}
+    with pytest.raises(Exception):
+        memory.extract_entity("Kyoto was the capital of Japan.")
+
+    memory.llm = FakeListLLM(responses=[
+        '{"1": {"Tokyo": "The capital of Japan."}, '
+        '"2": {"Kyoto": "The old capital."}}'])
+    extracted = memory.flush_extraction()
+    assert [entities for _, entities in extracted] == [
+        {"Tokyo": "The capital of Japan."}, {"Kyoto": "The old capital."}]
+
+
+def test_unnumbered_batch_entities_are_extracted_per_text(embeddings):
+    memory = SemanticMemory(llm=FakeListLLM(responses=[
+        '{"Tokyo": "The capital of Japan.", "Kyoto": "The old capital."}',
+        '{"Tokyo": "The capital of Japan."}',
+        '{"Kyoto": "The old capital."}',
+    ]), embeddings=embeddings, extraction_batch_steps=3)
+    memory.extract_entity("Tokyo is the capital of Japan.")
+    memory.extract_entity("Kyoto was the capital of Japan.")
+    assert [entities for _, entities in memory.flush_extraction()] == [
+        {"Tokyo": "The capital of Japan."}, {"Kyoto": "The old capital."}]
@@ -1,36 +1,187 @@
+import asyncio
+import functools
 import inspect
-from pydantic import Field, Extra, validator, BaseModel
-from typing import Any, Callable, Dict
+import threading
+import time
+from pydantic import Field, Extra, validator, BaseModel, PrivateAttr
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple, Union
+from tools.cache import CACHED_RESULT_NOTE, ToolCacheConfig, ToolResultCache
+from tools.latency import record_tool_latency
+
+DEFAULT_TOOL_TIMEOUT = 120.0
 
 
 class AgentToolError(Exception):
     pass
 
 
+class AgentToolTimeoutError(AgentToolError):
+    """Exception for a tool call that did not finish before its deadline"""
+
+    def __init__(self, tool_name: str, timeout: float) -> None:
+        super().__init__(
+            f"Tool {tool_name} timed out after {timeout:g} seconds "
+            "and its call was abandoned")
+        self.tool_name = tool_name
+        self.timeout = timeout
+
+
 class AgentTool(BaseModel):
     """
     Base class for agent tools.    
     """
     name: str
     description: str = Field(..., description="The description of the tool")
-    func: Callable[[str], str] = Field(..., description="The function to execute")
+    func: Callable[..., Union[str, Awaitable[str]]] = Field(
+        ..., description="The function to execute, or a coroutine function")
     args: Dict[str, str] = Field(default={})
     user_permission_required: bool = Field(
         False, description="Whether the user permission is required before using this tool")
+    cache: Optional[ToolCacheConfig] = Field(
+        None,
+        description="How the results of the tool are cached, or None to always run it")
+    result_cache: Optional[ToolResultCache] = Field(
+        None, description="The store of the cached results, in memory if None")
+    timeout: Optional[float] = Field(
+        DEFAULT_TOOL_TIMEOUT,
+        description="The seconds a call may run before it is abandoned, "
+                    "or None to wait forever")
+    # Tool infos and arguments memoized by what they are computed from.
+    _tool_info_cache: Tuple[Tuple[Any, ...], Dict[bool, str]] = PrivateAttr(((), {}))
+    _args_cache: Tuple[Any, Dict[str, str]] = PrivateAttr((None, {}))
 
     class Config:
         extra = Extra.allow
+        arbitrary_types_allowed = True
 
     def run(self, **kwargs: Any) -> str:
-        """Run the tool."""
+        """
+        Run the tool.
+        With a cache, a cached result is returned with a note saying when it was cached.
+        """
+        key, cached = self._lookup_cache(kwargs)
+        if cached is not None:
+            return cached
+        result = self._run(**kwargs)
+        self._update_cache(key, result)
+        return result
+
+    async def arun(self, **kwargs: Any) -> str:
+        """
+        Run the tool without blocking the event loop.
+        A coroutine function is awaited and cancelled at its deadline,
+        and a plain function runs in a worker thread.
+        """
+        key, cached = self._lookup_cache(kwargs)
+        if cached is not None:
+            return cached
+        if inspect.iscoroutinefunction(self.func):
+            result = await self._arun(**kwargs)
+        else:
+            result = await asyncio.get_running_loop().run_in_executor(
+                None, functools.partial(self._run, **kwargs))
+        self._update_cache(key, result)
+        return result
+
+    def _lookup_cache(
+            self, kwargs: Dict[str, Any]) -> Tuple[Optional[str], Optional[str]]:
+        """
+        Get the cache key of a call and its cached result with the staleness note, if
+        any.
+        """
+        if self.cache is None:
+            return None, None
+        if self.result_cache is None:
+            self.result_cache = ToolResultCache()
+        key = self.result_cache.make_key(self.name, self.cache.normalizer(kwargs))
+        cached = self.result_cache.lookup(key, ttl=self.cache.ttl)
+        if cached is None:
+            return key, None
+        result, created_at = cached
+        note = CACHED_RESULT_NOTE.format(
+            cached_at=time.strftime("%c", time.localtime(created_at)))
+        return key, f"{result}\n{note}"
+
+    def _update_cache(self, key: Optional[str], result: Any) -> None:
+        if key is not None:
+            self.result_cache.update(
+                self.name, key, str(result), max_size=self.cache.max_size)
+
+    def _call_func(self, **kwargs: Any) -> Any:
+        if inspect.iscoroutinefunction(self.func):
+            # A coroutine function run synchronously gets its own event loop.
+            return asyncio.run(self.func(**kwargs))
+        return self.func(**kwargs)
+
+    async def _arun(self, **kwargs: Any) -> str:
+        """Await the coroutine function, cancelling it when the deadline passes."""
+        start = time.monotonic()
         try:
-            result = self.func(**kwargs)
-        except (Exception, KeyboardInterrupt) as e:
+            result = await asyncio.wait_for(self.func(**kwargs), self.timeout)
+        except asyncio.TimeoutError:
+            record_tool_latency(self.name, time.monotonic() - start, timed_out=True)
+            raise AgentToolTimeoutError(self.name, self.timeout)
+        except Exception as e:
+            record_tool_latency(self.name, time.monotonic() - start)
             raise AgentToolError(str(e))
+        record_tool_latency(self.name, time.monotonic() - start)
         return result
 
+    def _run(self, **kwargs: Any) -> str:
+        """
+        Call the function, in a worker thread when the tool has a timeout.
+        A Python thread cannot be killed, so a call past its deadline is
+        abandoned: it keeps running in its daemon thread and its result is dropped.
+        """
+        start = time.monotonic()
+        if self.timeout is None:
+            try:
+                result = self._call_func(**kwargs)
+            except (Exception, KeyboardInterrupt) as e:
+                raise AgentToolError(str(e))
+            finally:
+                record_tool_latency(self.name, time.monotonic() - start)
+            return result
+
+        outcome: Dict[str, Any] = {}
+
+        def call() -> None:
+            try:
+                outcome["result"] = self._call_func(**kwargs)
+            except (Exception, KeyboardInterrupt) as e:
+                outcome["error"] = e
+
+        worker = threading.Thread(target=call, name=f"tool-{self.name}", daemon=True)
+        worker.start()
+        worker.join(self.timeout)
+        if worker.is_alive():
+            record_tool_latency(self.name, time.monotonic() - start, timed_out=True)
+            raise AgentToolTimeoutError(self.name, self.timeout)
+        record_tool_latency(self.name, time.monotonic() - start)
+        if "error" in outcome:
+            raise AgentToolError(str(outcome["error"]))
+        return outcome["result"]
+
     def get_tool_info(self, include_args=True) -> str:
         """Get the tool info."""
+        source = (self.name, self.description, self.func)
+        if len(source) != len(self._tool_info_cache[0]) \
+                or any(a is not b for a, b in zip(source, self._tool_info_cache[0])):
+            self._tool_info_cache = (source, {})
+        tool_infos = self._tool_info_cache[1]
+        if include_args not in tool_infos:
+            tool_infos[include_args] = self._build_tool_info(include_args)
+        return tool_infos[include_args]
+
+    def clear_tool_info_cache(self) -> None:
+        """
+        Forget the tool infos and the arguments,
+        so they are built again from the function.
+        """
+        self._tool_info_cache = ((), {})
+        self._args_cache = (None, {})
+
+    def _build_tool_info(self, include_args: bool) -> str:
         args_str = ", ".join([f"{k}: <{v}>" for k, v in self.args.items()])
 
         if include_args:
@@ -41,6 +192,11 @@ class AgentTool(BaseModel):
     @property
     def args(self) -> Dict:
         """Get the argument name and argument type from the signature"""
+        if self._args_cache[0] is not self.func:
+            self._args_cache = (self.func, self._signature_args())
+        return self._args_cache[1]
+
+    def _signature_args(self) -> Dict:
         func_signature = inspect.signature(self.func)
         required_args = {}
 
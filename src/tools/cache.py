@@ -0,0 +1,119 @@
+import hashlib
+import json
+import time
+from typing import Any, Callable, Dict, Optional, Tuple
+from pydantic import BaseModel, Field
+from memory.sqlite_store import SqliteStore
+
+TOOL_CACHE_FILENAME = "tool_cache.sqlite3"
+DEFAULT_TOOL_CACHE_TTL = 24 * 60 * 60
+DEFAULT_TOOL_CACHE_MAX_SIZE = 1000
+CACHED_RESULT_NOTE = "(This result was cached on {cached_at} and may be stale.)"
+
+
+def normalize_args(args: Any) -> Any:
+    """Fold the case and the whitespace of the strings in tool arguments."""
+    if isinstance(args, str):
+        return " ".join(args.split()).casefold()
+    if isinstance(args, dict):
+        return {k: normalize_args(v) for k, v in args.items()}
+    if isinstance(args, (list, tuple)):
+        return [normalize_args(v) for v in args]
+    return args
+
+
+class ToolCacheConfig(BaseModel):
+    """How the results of a tool are cached."""
+    ttl: Optional[float] = Field(
+        DEFAULT_TOOL_CACHE_TTL,
+        description="The seconds a result is served from the cache, or None to never "
+                    "expire")
+    max_size: Optional[int] = Field(
+        DEFAULT_TOOL_CACHE_MAX_SIZE,
+        description="The number of results kept for the tool, or None for no limit")
+    normalizer: Callable[[Dict[str, Any]], Any] = Field(
+        normalize_args,
+        description="The function mapping the arguments to what the cache key is made "
+                    "of")
+
+
+class ToolResultCache(SqliteStore):
+    """
+    Tool results keyed by the tool name and the normalized arguments.
+    Expired results are dropped when they are looked up, and each tool keeps
+    at most its max size of results, evicting the least recently used.
+    """
+    schema = """
+        CREATE TABLE IF NOT EXISTS results (
+            key TEXT PRIMARY KEY,
+            tool TEXT NOT NULL,
+            result TEXT NOT NULL,
+            created_at REAL NOT NULL,
+            accessed_at REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS results_tool_accessed ON results (tool, accessed_at);
+    """
+
+    def __init__(self, path: Optional[str] = None) -> None:
+        super().__init__(path)
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(tool_name: str, args: Any) -> str:
+        """Get the cache key of a tool call."""
+        data = json.dumps([tool_name, args], sort_keys=True, default=str)
+        return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+    def lookup(
+            self, key: str, ttl: Optional[float] = None) -> Optional[Tuple[str, float]]:
+        """
+        Look up the result of a key and when it was cached, unless it is older than ttl.
+        """
+        now = time.time()
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT result, created_at FROM results WHERE key = ?",
+                (key,)).fetchone()
+            if row is not None and ttl is not None and now - row[1] > ttl:
+                self.conn.execute("DELETE FROM results WHERE key = ?", (key,))
+                self.conn.commit()
+                row = None
+            if row is None:
+                self.misses += 1
+                return None
+            self.conn.execute(
+                "UPDATE results SET accessed_at = ? WHERE key = ?", (now, key))
+            self.conn.commit()
+            self.hits += 1
+            return row[0], row[1]
+
+    def update(self, tool_name: str, key: str, result: str,
+               max_size: Optional[int] = None) -> None:
+        """
+        Cache the result of a key, evicting the least recently used results of the tool
+        beyond max_size.
+        """
+        now = time.time()
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO results "
+                "(key, tool, result, created_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+                (key, tool_name, result, now, now))
+            if max_size is not None:
+                self.conn.execute(
+                    """DELETE FROM results WHERE tool = ? AND key NOT IN (
+                        SELECT key FROM results WHERE tool = ?
+                        ORDER BY accessed_at DESC LIMIT ?)""",
+                    (tool_name, tool_name, max_size))
+            self.conn.commit()
+
+    def stats(self) -> Dict[str, int]:
+        """Get the hit and miss counters of the cache."""
+        return {"hits": self.hits, "misses": self.misses}
+
+    def __copy__(self) -> "ToolResultCache":
+        return self
+
+    def __deepcopy__(self, memo: Dict[int, Any]) -> "ToolResultCache":
+        return self
@@ -0,0 +1,78 @@
+import bisect
+import threading
+from typing import Any, Dict, List, Optional
+
+# Upper bounds in seconds of the latency buckets, the last one catching the rest
+LATENCY_BUCKETS = [
+    0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, float("inf")]
+
+
+class LatencyHistogram:
+    """Histogram of the latencies of one tool, with the calls that timed out."""
+
+    def __init__(self) -> None:
+        self.counts: List[int] = [0] * len(LATENCY_BUCKETS)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.timeouts = 0
+
+    def record(self, seconds: float, timed_out: bool = False) -> None:
+        """Record the latency of one call."""
+        self.counts[bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        if timed_out:
+            self.timeouts += 1
+
+    def percentile(self, q: float) -> Optional[float]:
+        """
+        Get the upper bound of the bucket holding the q-th percentile, q in [0, 100].
+        """
+        if not self.count:
+            return None
+        rank = q / 100 * self.count
+        seen = 0
+        for bound, count in zip(LATENCY_BUCKETS, self.counts):
+            seen += count
+            if seen >= rank and count:
+                return min(bound, self.max)
+        return self.max
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "count": self.count,
+            "timeouts": self.timeouts,
+            "mean": self.total / self.count if self.count else None,
+            "p50": self.percentile(50),
+            "p95": self.percentile(95),
+            "max": self.max,
+            "buckets": {str(bound): count
+                        for bound, count in zip(LATENCY_BUCKETS, self.counts) if count},
+        }
+
+
+_histograms: Dict[str, LatencyHistogram] = {}
+_histograms_lock = threading.Lock()
+
+
+def record_tool_latency(
+        tool_name: str, seconds: float, timed_out: bool = False) -> None:
+    """Record the latency of one call of a tool."""
+    with _histograms_lock:
+        _histograms.setdefault(tool_name, LatencyHistogram()).record(seconds, timed_out)
+
+
+def get_tool_latency_stats() -> Dict[str, Dict[str, Any]]:
+    """Get the latency histogram of each tool, slowest tools first."""
+    with _histograms_lock:
+        stats = {name: histogram.to_dict() for name, histogram in _histograms.items()}
+    return dict(sorted(
+        stats.items(), key=lambda item: item[1]["p95"] or 0, reverse=True))
+
+
+def reset_tool_latency_stats() -> None:
+    """Reset the latency histograms."""
+    with _histograms_lock:
+        _histograms.clear()